@@ -0,0 +1,104 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import pytz
+
+# FIT positions are stored as semicircles (2^31 semicircles = 180 degrees)
+SEMICIRCLE_TO_DEGREES = 180 / 2**31
+# Running paces slower than this (min/km) are treated as stops
+MAX_RUNNING_PACE = 12
+
+#########################################################################
+# Vectorized conversions
+def epoch_seconds(timestamps):
+    """Parses UTC timestamps (datetimes or ISO text, naive means UTC) into int64 epoch seconds."""
+    times = pd.to_datetime(timestamps, utc=True, format='ISO8601')
+    return np.asarray(times.astype('int64')) // 10**9
+
+
+@lru_cache(maxsize=None)
+def tz_transitions(tz_name):
+    """Epoch seconds at which `tz_name` changes its UTC offset, and the offset (seconds) from each on."""
+    tz = pytz.timezone(tz_name)
+    transitions = getattr(tz, '_utc_transition_times', None)
+    if not transitions:
+        # Fixed offset zones (UTC, Etc/GMT+5, ...)
+        return np.array([np.iinfo(np.int64).min]), np.array([int(tz.utcoffset(None).total_seconds())])
+    starts = np.array(transitions, dtype='datetime64[s]').astype('int64')
+    offsets = np.array([int(offset.total_seconds()) for offset, _, _ in tz._transition_info])
+    return starts, offsets
+
+
+def to_local(epochs, tz_name):
+    """Naive `tz_name` local times of UTC epoch seconds, as one vectorized offset lookup and add."""
+    epochs = np.asarray(epochs, dtype='int64')
+    starts, offsets = tz_transitions(tz_name)
+    return (epochs + offsets[np.searchsorted(starts, epochs, side='right') - 1]).astype('datetime64[s]')
+
+
+def mask_zeros(values):
+    """Returns `values` as floats with zeros replaced by NaN."""
+    values = np.asarray(values, dtype=float)
+    return np.where(values == 0, np.nan, values)
+
+
+def speed_to_pace(speed, max_pace=MAX_RUNNING_PACE):
+    """Converts m/s to min/km, with stops and paces above `max_pace` as NaN."""
+    speed = mask_zeros(speed)
+    pace = 1000 / 60 / speed
+    pace[pace > max_pace] = np.nan
+    return pace
+
+
+def semicircles_to_degrees(values):
+    return np.asarray(values, dtype=float) * SEMICIRCLE_TO_DEGREES
+
+
+def format_duration(seconds):
+    """Formats a duration in seconds as hh:mm:ss."""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+#########################################################################
+# Per-sport record processing
+def load_records(record_mesgs):
+    """Builds the records DataFrame with timestamps as UTC epoch seconds.
+
+    Timestamps stay independent of the timezone, see `to_local` for display.
+    """
+    records = pd.DataFrame(record_mesgs)
+    records['timestamp'] = epoch_seconds(records['timestamp'])
+    return records
+
+
+def process_running(records):
+    # Pace in min/km, zero speed and cadence are missing samples
+    records['enhanced_speed'] = speed_to_pace(records['enhanced_speed'])
+    records['cadence'] = mask_zeros(records['cadence'])
+    return records
+
+
+def process_cycling(records):
+    """Converts speed to km/h and returns the records with their averages.
+
+    The averages are taken before zeros are masked, so coasting counts. On
+    resampled records (see resample.py) they are time-weighted.
+    """
+    records['enhanced_speed'] = records['enhanced_speed'].to_numpy(dtype=float) * 3.6
+    averages = {
+        'power': records['power'].mean(),
+        'cadence': records['cadence'].mean(),
+        'speed': records['speed'].mean(),
+    }
+    for column in ['enhanced_speed', 'cadence', 'power']:
+        records[column] = mask_zeros(records[column])
+    return records, averages
+
+
+def route_degrees(records):
+    """Returns the latitude and longitude arrays (degrees) of the GPS samples."""
+    positions = records[['position_lat', 'position_long']].dropna()
+    return (semicircles_to_degrees(positions['position_lat']),
+            semicircles_to_degrees(positions['position_long']))
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+# Distances whose fastest effort is kept for runs (meters)
+BEST_DISTANCES = {
+    '400m': 400,
+    '1k': 1000,
+    '1 mile': 1609.344,
+    '5k': 5000,
+    '10k': 10000,
+    'half marathon': 21097.5,
+    'marathon': 42195,
+}
+# Window lengths (seconds) of the power-duration curve, 5 s to 60 min
+POWER_DURATIONS = [5, 10, 15, 30, 60, 120, 300, 600, 1200, 1800, 2700, 3600]
+# Days covered by the recent envelope
+RECENT_DAYS = 90
+
+#########################################################################
+# Per-activity curves
+def elapsed_seconds(timestamps):
+    """Seconds since the first record, from UTC epoch seconds."""
+    epochs = np.asarray(timestamps, dtype='int64')
+    return (epochs - epochs[0]).astype(float)
+
+
+def fastest_efforts(seconds, distance, distances=BEST_DISTANCES):
+    """Fastest time (seconds) over each of `distances`, starting at any record.
+
+    Every start is tried at once: the time at which the cumulative distance
+    first reaches start + d is interpolated from the sorted distances.
+    """
+    present = ~np.isnan(distance)
+    seconds, distance = seconds[present], distance[present]
+    # The distance only ever grows, small GPS corrections aside
+    distance = np.maximum.accumulate(distance)
+    efforts = {}
+    for label, meters in distances.items():
+        if len(distance) < 2 or distance[-1] - distance[0] < meters:
+            continue
+        starts = np.flatnonzero(distance + meters <= distance[-1])
+        ends = np.interp(distance[starts] + meters, distance, seconds)
+        efforts[label] = float((ends - seconds[starts]).min())
+    return efforts
+
+
+def power_curve(seconds, power, durations=POWER_DURATIONS):
+    """Best average power (W) for each window in `durations`.
+
+    The power is laid on a one-second grid (missing seconds count as zero), so
+    each window's mean is a difference of two cumulative sums.
+    """
+    grid = np.zeros(int(round(seconds[-1])) + 1)
+    grid[np.round(seconds).astype(int)] = np.nan_to_num(power)
+    sums = np.concatenate([[0], np.cumsum(grid)])
+    curve = {}
+    for duration in durations:
+        if duration > len(grid):
+            break
+        curve[str(duration)] = float((sums[duration:] - sums[:-duration]).max() / duration)
+    return curve
+
+
+def best_efforts(records):
+    """Fastest efforts and power curve of an activity's resampled records (rollup.py stores them)."""
+    efforts = {}
+    if records.empty or 'timestamp' not in records:
+        return efforts
+    seconds = elapsed_seconds(records['timestamp'])
+    if 'distance' in records:
+        efforts['fastest'] = fastest_efforts(seconds, records['distance'].to_numpy(dtype=float))
+    if 'power' in records:
+        efforts['power'] = power_curve(seconds, records['power'].to_numpy(dtype=float))
+    return efforts
+
+#########################################################################
+# Envelopes across activities
+def curves_frame(summaries, kind, columns):
+    """One row per activity (indexed by start time) with its `kind` curve in `columns`."""
+    rows = [(summary['start_time'], summary.get('best_efforts', {}).get(kind, {})) for summary in summaries]
+    frame = pd.DataFrame([curve for _, curve in rows], index=pd.DatetimeIndex([start for start, _ in rows]),
+                         columns=columns, dtype=float)
+    return frame.sort_index()
+
+
+def envelopes(frame, best, now, days=RECENT_DAYS):
+    """All-time and recent envelope of the curves in `frame`.
+
+    `best` is 'min' for times or 'max' for power. The frame is tiny (one row
+    per activity), so both envelopes are a single column reduction.
+    """
+    recent = frame[frame.index >= now - pd.Timedelta(days=days)]
+    return pd.DataFrame({'all time': frame.agg(best), f'last {days} days': recent.agg(best)})
@@ -2,7 +2,7 @@ import warnings
 warnings.filterwarnings('ignore')
 
 import os
-import numpy as np
+import math
 import pandas as pd
 
 import hmac
@@ -10,19 +10,31 @@ import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
 
-import folium
 from streamlit_folium import folium_static
 
-import pymongo
-import psycopg2
+import data
+import activity
+import analytics
+import figures
+import rolling
+import instrument
 
 import pytz
-from dateutil.parser import parse
 from dateutil.tz import tzutc
 from datetime import datetime, timedelta, time
 
 st.set_page_config(layout="wide")
 
+# Number of activities listed per page
+ACTIVITIES_PER_PAGE = 10
+# Width (px) of the route thumbnails next to the activity list
+THUMBNAIL_WIDTH = 60
+# Filter defaults
+DEFAULT_TIMEZONE = 'America/Guatemala'
+ACTIVITY_DAYS = 7
+STRENGTH_WINDOWS = {'Last 90 days': 90, 'Last year': 365, 'All time': None}
+DEFAULT_STRENGTH_WINDOW = 'Last year'
+
 #########################################################################
 def check_password():
     """Returns `True` if the user had the correct password."""
@@ -51,436 +63,358 @@ def check_password():
 if not check_password():
     st.stop()  # Do not continue if check_password is not True.
 
-#########################################################################
-# Database connection parameters
-db_params = {
-    'database': 'postgres',
-    'user': st.secrets["pg_username"],
-    'password': st.secrets["pg_password"],
-    'host': st.secrets["pg_host"],
-    'port': st.secrets["pg_port"]
-}
-
-# Connect to the PostgreSQL database
-conn = psycopg2.connect(**db_params)
-
-# Query to select all rows from the fitness.weight table
-query = "SELECT * FROM fitness.weight;"
-
-# Load the data into a pandas DataFrame
-df_weight = pd.read_sql(query, conn)
-
-query = "SELECT * FROM fitness.strength;"
-
-df_strength = pd.read_sql(query, conn)
-
-# Close the database connection
-conn.close()
+# Stage timings for this rerun (see instrument.py for the debug panel and profiling),
+# started after the login so the password screen is never profiled
+instrument.start()
 
 #########################################################################
 # Streamlit code
 st.title('Fitness Dashboard')
 
-# st.write(df_weight)
+# Drop the cached tables and activity queries and load everything again
+if st.button('Refresh data'):
+    data.clear_caches()
+    figures.clear_caches()
+    st.rerun()
 
 #########################################################################
-# Streamlit code
-mcol1, mcol2, mcol3, mcol4 = st.columns(4)
-mgoal1 = 125
-mgoal2 = 123
-mgoal3 = 125
-mgoal4 = 2
-# Calculate the most recent weight (most recent 'date' value)
-recent_weight = df_weight['lbs'].iloc[-1]
-mdiff1 = recent_weight - mgoal1
-mdiff2 = recent_weight - mgoal2
-# Calculate the median weight for the last 10 days
-median_weight = df_weight['lbs'].iloc[-10:].median()
-mdiff3 = median_weight - mgoal3
-# Calculate the standard deviation for the last 10 days
-std_weight = df_weight['lbs'].iloc[-10:].std()
-mdiff4 = std_weight - mgoal4
-# round to 2 decimal places
-mdiff4 = round(mdiff4, 2)
-mcol1.metric("Short Term Low Goal", mgoal1, mdiff1)
-mcol2.metric("Mid Term Low Goal", mgoal2, mdiff2)
-mcol3.metric("Median Weight Goal", mgoal3, mdiff3)
-mcol4.metric("Standard Deviation Goal", mgoal4, mdiff4)
-
-#########################################################################
-st.markdown('## 10 day Median Weight and Average Calories')
-# First, you need to calculate 10 day median for the 'lbs' column, 
-# 10 day average for the 'caloric_intake' column and 7 day average for the 'cardio_calories' column
-df_weight['median_10d_lbs'] = df_weight['lbs'].rolling(window=10, min_periods = 3).median()
-df_weight['avg_10d_caloric_intake'] = df_weight['caloric_intake'].rolling(window=10, min_periods = 3).mean()
-df_weight['avg_7d_cardio_calories'] = df_weight['cardio_calories'].rolling(window=10, min_periods = 3).mean()
-
-# Create another line chart for df_weight with 'date' on the x-axis, and 'median_10d_lbs', 'avg_10d_caloric_intake', 'avg_7d_cardio_calories' on the y-axes
-fig_weight_avg = go.Figure()
-
-# Add traces
-fig_weight_avg.add_trace(go.Scatter(x=df_weight['date'], y=df_weight['median_10d_lbs'], name='10 Day Median Lbs'))
-fig_weight_avg.add_trace(go.Scatter(x=df_weight['date'], y=df_weight['avg_10d_caloric_intake'], name='10 Day Avg Caloric Intake', yaxis='y2'))
-fig_weight_avg.add_trace(go.Scatter(x=df_weight['date'], y=df_weight['avg_7d_cardio_calories'], name='7 Day Avg Cardio Calories', yaxis='y3'))
-
-# Create axis objects
-fig_weight_avg.update_layout(
-    xaxis=dict(domain=[0.3, 1], showgrid=False),
-    yaxis=dict(title='10 Day Median Lbs', position=0.1, showgrid=False),
-    yaxis2=dict(title='10 Day Avg Caloric Intake', overlaying='y', side='left', position=0.2, showgrid=False),
-    yaxis3=dict(title='7 Day Avg Cardio Calories', overlaying='y', side='right', showgrid=False)
-)
-
-# Show the figure
-st.plotly_chart(fig_weight_avg, use_container_width=True)
-
-#########################################################################
-st.markdown('## Daily Weight')
-# Create a line chart for df_weight with 'date' on the x-axis, and 'lbs', 'caloric_intake', 'cardio_calories' on the y-axes
-fig_weight = go.Figure()
-
-# Add traces
-fig_weight.add_trace(go.Scatter(x=df_weight['date'], y=df_weight['lbs'], name='lbs'))
-fig_weight.add_trace(go.Scatter(x=df_weight['date'], y=df_weight['caloric_intake'], name='Caloric Intake', yaxis='y2'))
-fig_weight.add_trace(go.Scatter(x=df_weight['date'], y=df_weight['cardio_calories'], name='Cardio Calories', yaxis='y3'))
-
-# Create axis objects
-fig_weight.update_layout(
-    xaxis=dict(domain=[0.3, 1], showgrid=False),
-    yaxis=dict(title='lbs', position=0.1, showgrid=False),
-    yaxis2=dict(title='Caloric Intake', overlaying='y', side='left', position=0.2, showgrid=False),
-    yaxis3=dict(title='Cardio Calories', overlaying='y', side='right', showgrid=False)
-)
+# Every query of the page is sent at once. The widgets they depend on are drawn
+# further down, but this rerun's values are already in the session state.
+today = datetime.now().date()
+strength_period = st.session_state.get('strength_period', data.STRENGTH_PERIODS[0])
+window_days = STRENGTH_WINDOWS[st.session_state.get('strength_window', DEFAULT_STRENGTH_WINDOW)]
+strength_start = today - timedelta(days=window_days) if window_days else None
 
-# Show the figure
-st.plotly_chart(fig_weight, use_container_width=True)
+selected_tz = st.session_state.get('timezone', DEFAULT_TIMEZONE)
+local_tz = pytz.timezone(selected_tz)  # Define local_tz using the selected timezone
+start_datetime = datetime.combine(st.session_state.get('date_start', today - timedelta(days=ACTIVITY_DAYS)),
+                                  st.session_state.get('time_start', time(0, 0, 0)))
+end_datetime = datetime.combine(st.session_state.get('date_end', today),
+                                st.session_state.get('time_end', time(23, 59, 59)))
+# The filters are in the selected timezone, activities are stored in UTC
+start_utc = local_tz.localize(start_datetime).astimezone(pytz.utc)
+end_utc = local_tz.localize(end_datetime).astimezone(pytz.utc)
+
+# Cached tables and queries, only new rows are queried (see data.py)
+fetched, fetch_errors = data.fetch_all({
+    'weight': (data.load_weight, ()),
+    'strength': (data.load_strength_totals, (strength_period, strength_start)),
+    'best efforts': (data.load_best_efforts, ()),
+    'activities': (data.load_summaries, (start_utc, end_utc)),
+})
+for name, error in fetch_errors.items():
+    # The rest of the page still renders, the next rerun picks up the late result
+    st.warning(f"The {name} could not be loaded ({error}), that section is left out.")
+instrument.lap('concurrent fetch')
+
+df_weight = fetched.get('weight')
+if df_weight is not None:
+    instrument.count('weight rows', len(df_weight))
+
+    # 10 day median/std of 'lbs', 10 day average 'caloric_intake' and 7 day average 'cardio_calories',
+    # over calendar days and only recomputed for the days that changed since the last rerun
+    weight_stats = rolling.weight_stats().update(df_weight)
+    for column in weight_stats:
+        df_weight[column] = weight_stats[column].to_numpy()
+    instrument.lap('rolling statistics')
+
+    #########################################################################
+    # Streamlit code
+    mcol1, mcol2, mcol3, mcol4 = st.columns(4)
+    mgoal1 = 125
+    mgoal2 = 123
+    mgoal3 = 125
+    mgoal4 = 2
+    # Calculate the most recent weight (most recent 'date' value)
+    recent_weight = df_weight['lbs'].iloc[-1]
+    mdiff1 = recent_weight - mgoal1
+    mdiff2 = recent_weight - mgoal2
+    # The median weight for the last 10 days
+    median_weight = df_weight['median_10d_lbs'].iloc[-1]
+    mdiff3 = median_weight - mgoal3
+    # The standard deviation for the last 10 days
+    std_weight = df_weight['std_10d_lbs'].iloc[-1]
+    mdiff4 = std_weight - mgoal4
+    # round to 2 decimal places
+    mdiff4 = round(mdiff4, 2)
+    mcol1.metric("Short Term Low Goal", mgoal1, mdiff1)
+    mcol2.metric("Mid Term Low Goal", mgoal2, mdiff2)
+    mcol3.metric("Median Weight Goal", mgoal3, mdiff3)
+    mcol4.metric("Standard Deviation Goal", mgoal4, mdiff4)
+
+    #########################################################################
+    st.markdown('## 10 day Median Weight and Average Calories')
+    # Create another line chart for df_weight with 'date' on the x-axis, and 'median_10d_lbs', 'avg_10d_caloric_intake', 'avg_7d_cardio_calories' on the y-axes
+    fig_weight_avg = go.Figure()
+
+    # Add traces
+    fig_weight_avg.add_trace(go.Scatter(x=df_weight['date'], y=df_weight['median_10d_lbs'], name='10 Day Median Lbs'))
+    fig_weight_avg.add_trace(go.Scatter(x=df_weight['date'], y=df_weight['avg_10d_caloric_intake'], name='10 Day Avg Caloric Intake', yaxis='y2'))
+    fig_weight_avg.add_trace(go.Scatter(x=df_weight['date'], y=df_weight['avg_7d_cardio_calories'], name='7 Day Avg Cardio Calories', yaxis='y3'))
+
+    # Create axis objects
+    fig_weight_avg.update_layout(
+        xaxis=dict(domain=[0.3, 1], showgrid=False),
+        yaxis=dict(title='10 Day Median Lbs', position=0.1, showgrid=False),
+        yaxis2=dict(title='10 Day Avg Caloric Intake', overlaying='y', side='left', position=0.2, showgrid=False),
+        yaxis3=dict(title='7 Day Avg Cardio Calories', overlaying='y', side='right', showgrid=False)
+    )
 
-#########################################################################
-st.markdown('## 10 Day Weight Standard Deviation')
-# Calculate the rolling standard deviation for the 'lbs' column with a window of 10 days
-df_weight['std_10d_lbs'] = df_weight['lbs'].rolling(window=10, min_periods=1).std()
-
-# Create a line chart for the rolling standard deviation
-fig_std_dev = go.Figure()
-
-# Add trace for standard deviation
-fig_std_dev.add_trace(go.Scatter(x=df_weight['date'],
-                                 y=df_weight['std_10d_lbs'],
-                                 name='10 Day Std Dev Lbs'))
-
-# Update layout to add titles and adjust axes
-fig_std_dev.update_layout(
-    title='10 Day Rolling Standard Deviation of Weight',
-    xaxis_title='Date',
-    yaxis_title='Standard Deviation (lbs)',
-    xaxis=dict(showgrid=False),
-    yaxis=dict(showgrid=False)
-)
+    # Show the figure
+    st.plotly_chart(fig_weight_avg, use_container_width=True)
+
+    #########################################################################
+    st.markdown('## Daily Weight')
+    # Create a line chart for df_weight with 'date' on the x-axis, and 'lbs', 'caloric_intake', 'cardio_calories' on the y-axes
+    fig_weight = go.Figure()
+
+    # Add traces
+    fig_weight.add_trace(go.Scatter(x=df_weight['date'], y=df_weight['lbs'], name='lbs'))
+    fig_weight.add_trace(go.Scatter(x=df_weight['date'], y=df_weight['caloric_intake'], name='Caloric Intake', yaxis='y2'))
+    fig_weight.add_trace(go.Scatter(x=df_weight['date'], y=df_weight['cardio_calories'], name='Cardio Calories', yaxis='y3'))
+
+    # Create axis objects
+    fig_weight.update_layout(
+        xaxis=dict(domain=[0.3, 1], showgrid=False),
+        yaxis=dict(title='lbs', position=0.1, showgrid=False),
+        yaxis2=dict(title='Caloric Intake', overlaying='y', side='left', position=0.2, showgrid=False),
+        yaxis3=dict(title='Cardio Calories', overlaying='y', side='right', showgrid=False)
+    )
 
-# Show the figure
-st.plotly_chart(fig_std_dev, use_container_width=True)
+    # Show the figure
+    st.plotly_chart(fig_weight, use_container_width=True)
+
+    #########################################################################
+    st.markdown('## 10 Day Weight Standard Deviation')
+    # Create a line chart for the rolling standard deviation
+    fig_std_dev = go.Figure()
+
+    # Add trace for standard deviation
+    fig_std_dev.add_trace(go.Scatter(x=df_weight['date'],
+                                     y=df_weight['std_10d_lbs'],
+                                     name='10 Day Std Dev Lbs'))
+
+    # Update layout to add titles and adjust axes
+    fig_std_dev.update_layout(
+        title='10 Day Rolling Standard Deviation of Weight',
+        xaxis_title='Date',
+        yaxis_title='Standard Deviation (lbs)',
+        xaxis=dict(showgrid=False),
+        yaxis=dict(showgrid=False)
+    )
 
-#########################################################################
-# st.write(df_weight)
+    # Show the figure
+    st.plotly_chart(fig_std_dev, use_container_width=True)
+    instrument.lap('weight figures')
+
+    #########################################################################
+    # st.write(df_weight)
+
+    #########################################################################
+    # Create two separate charts with plotly express
+    fig1 = px.bar(df_weight, x='date', y='run_kms',
+                  color = df_weight['run_type'],
+                  title='Run Kms')
+    fig2 = px.bar(df_weight, x='date', y='run_calories',
+                    color = df_weight['run_type'],
+                    title='Run Calories')
+
+    # Create two columns in Streamlit page
+    run_col1, run_col2 = st.columns(2)
+
+    # Show each figure in respective column
+    run_col1.plotly_chart(fig1, use_container_width=True)
+    run_col2.plotly_chart(fig2, use_container_width=True)
+
+    #########################################################################
+    # Create two separate charts with plotly express
+    fig3 = px.bar(df_weight, x='date', y='bike_kms',
+                  color = df_weight['bike_type'],
+                  title='Bike Kms')
+    fig4 = px.bar(df_weight, x='date', y='bike_calories',
+                    color = df_weight['bike_type'],
+                    title='Bike Calories')
+
+    # Create two columns in Streamlit page
+    bike_col1, bike_col2 = st.columns(2)
+
+    # Show each figure in respective column
+    bike_col1.plotly_chart(fig3, use_container_width=True)
+    bike_col2.plotly_chart(fig4, use_container_width=True)
 
 #########################################################################
-# Create two separate charts with plotly express
-fig1 = px.bar(df_weight, x='date', y='run_kms',
-              color = df_weight['run_type'],
-              title='Run Kms')
-fig2 = px.bar(df_weight, x='date', y='run_calories',
-                color = df_weight['run_type'],
-                title='Run Calories')
-
-# Create two columns in Streamlit page
-run_col1, run_col2 = st.columns(2)
-
-# Show each figure in respective column
-run_col1.plotly_chart(fig1, use_container_width=True)
-run_col2.plotly_chart(fig2, use_container_width=True)
+st.markdown('## Strength')
+# Totals are grouped per day or week in Postgres (cached), whatever the number of sets
+strength_col1, strength_col2 = st.columns(2)
+with strength_col1:
+    st.radio('Group sets by', data.STRENGTH_PERIODS, horizontal=True, key='strength_period')
+with strength_col2:
+    st.selectbox('Strength window', list(STRENGTH_WINDOWS), index=list(STRENGTH_WINDOWS).index(DEFAULT_STRENGTH_WINDOW),
+                 key='strength_window')
+
+df_strength = fetched.get('strength')
+exercises = []
+if df_strength is not None:
+    instrument.count('strength total rows', len(df_strength))
+    exercises = sorted(df_strength['exercise'].unique())
+
+# One chart per exercise, two per row
+for row_start in range(0, len(exercises), 2):
+    for col, exercise in zip(st.columns(2), exercises[row_start:row_start + 2]):
+        with col:
+            fig_exercise = px.bar(df_strength[df_strength['exercise'] == exercise], x='date', y='reps',
+                                  color='variation', hover_data=['sets', 'volume'], title=exercise.capitalize())
+            fig_exercise.update_xaxes(showgrid=False)
+            fig_exercise.update_yaxes(showgrid=False)
+            st.plotly_chart(fig_exercise, use_container_width=True)
+instrument.lap('run, bike and strength figures')
 
 #########################################################################
-# Create two separate charts with plotly express
-fig3 = px.bar(df_weight, x='date', y='bike_kms',
-              color = df_weight['bike_type'],
-              title='Bike Kms')
-fig4 = px.bar(df_weight, x='date', y='bike_calories',
-                color = df_weight['bike_type'],
-                title='Bike Calories')
-
-# Create two columns in Streamlit page
-bike_col1, bike_col2 = st.columns(2)
-
-# Show each figure in respective column
-bike_col1.plotly_chart(fig3, use_container_width=True)
-bike_col2.plotly_chart(fig4, use_container_width=True)
+st.markdown('## Best Efforts')
+# Every activity's curves were computed when it was summarized, only the envelopes are built here
+best_efforts = fetched.get('best efforts', [])
+# Start times come back from MongoDB as naive UTC
+now = pd.Timestamp.utcnow().tz_localize(None)
+runs = [summary for summary in best_efforts if summary['sport'] == 'running']
+rides = [summary for summary in best_efforts
+         if summary['sport'] == 'cycling' and summary['sub_sport'] == 'indoor_cycling']
+
+# Fastest times become min/km paces for each distance
+run_times = analytics.curves_frame(runs, 'fastest', list(analytics.BEST_DISTANCES))
+run_envelopes = analytics.envelopes(run_times, 'min', now)
+run_paces = run_envelopes.div(pd.Series(analytics.BEST_DISTANCES) / 1000, axis=0) / 60
+
+fig_paces = go.Figure()
+for column in run_paces:
+    fig_paces.add_trace(go.Scatter(x=run_paces.index, y=run_paces[column], name=column, mode='lines+markers',
+                                   text=[activity.format_duration(t) if pd.notna(t) else None for t in run_envelopes[column]],
+                                   hovertemplate='%{x}: %{text} (%{y:.2f} min/km)'))
+fig_paces.update_layout(
+    title='Fastest Pace by Distance',
+    xaxis=dict(title='Distance', showgrid=False),
+    yaxis=dict(title='Pace (min/km)', autorange='reversed', showgrid=False)
+)
 
-#########################################################################
-# st.write(df_strength)
+# Best average power for each window length
+ride_power = analytics.curves_frame(rides, 'power', [str(duration) for duration in analytics.POWER_DURATIONS])
+power_envelopes = analytics.envelopes(ride_power, 'max', now)
+
+fig_power = go.Figure()
+for column in power_envelopes:
+    fig_power.add_trace(go.Scatter(x=analytics.POWER_DURATIONS, y=power_envelopes[column], name=column,
+                                   text=[activity.format_duration(duration) for duration in analytics.POWER_DURATIONS],
+                                   hovertemplate='%{text}: %{y:.0f} W'))
+fig_power.update_layout(
+    title='Power-Duration Curve',
+    xaxis=dict(title='Duration (s)', type='log', showgrid=False),
+    yaxis=dict(title='Power (W)', showgrid=False)
+)
 
-#########################################################################
-# Filter data for pull ups and push ups
-df_pull_ups = df_strength[df_strength['exercise'] == 'pull ups']
-df_push_ups = df_strength[df_strength['exercise'] == 'push ups']
-
-# Make sure 'date' is datetime
-df_pull_ups['date'] = pd.to_datetime(df_pull_ups['date'])
-df_push_ups['date'] = pd.to_datetime(df_push_ups['date'])
-
-# Create side by side barcharts
-col1, col2 = st.columns(2)
-
-# pull ups
-with col1:
-    fig_pull_ups = px.bar(df_pull_ups, x='date', y='reps', color='variation', title='Pull ups')
-    fig_pull_ups.update_xaxes(showgrid=False)
-    fig_pull_ups.update_yaxes(showgrid=False)
-    st.plotly_chart(fig_pull_ups, use_container_width=True)
-
-# push ups
-with col2:
-    fig_push_ups = px.bar(df_push_ups, x='date', y='reps', color='variation', title='Push ups')
-    fig_push_ups.update_xaxes(showgrid=False)
-    fig_push_ups.update_yaxes(showgrid=False)
-    st.plotly_chart(fig_push_ups, use_container_width=True)
+efforts_col1, efforts_col2 = st.columns(2)
+efforts_col1.plotly_chart(fig_paces, use_container_width=True)
+efforts_col2.plotly_chart(fig_power, use_container_width=True)
+instrument.lap('best efforts')
 
 #########################################################################
-# Streamlit input to select timezone
+# Streamlit input to select timezone (its value was read before the queries were sent)
 timezones = pytz.all_timezones
-selected_tz = st.selectbox('Select your timezone:', timezones, index=timezones.index('America/Guatemala'))
-local_tz = pytz.timezone(selected_tz)  # Define local_tz using the selected timezone
+st.selectbox('Select your timezone:', timezones, index=timezones.index(DEFAULT_TIMEZONE), key='timezone')
 
-# Streamlit date filters
-today = datetime.now().date()
-first_date = today - timedelta(days=7)
 # Streamlit date filters
 date_col1, date_col2 = st.columns(2)
-#Start time from midnight
-time_start = time(0, 0, 0)
-#End time to midnight
-time_end = time(23, 59, 59)
 with date_col1:
-    date_start = st.date_input("Start Date",value=first_date)
-    date_end = st.date_input("End Date",value=today)
+    #Start and end dates, the last week by default
+    st.date_input("Start Date", value=today - timedelta(days=ACTIVITY_DAYS), key='date_start')
+    st.date_input("End Date", value=today, key='date_end')
 with date_col2:
-    time_start = st.time_input('Start Time', value=time_start)
-    time_end = st.time_input('End Time', value=time_end)
-#Streamlit Time filters
-start_datetime = datetime.combine(date_start, time_start)
-end_datetime = datetime.combine(date_end, time_end)
-
-# Converting datetime to string before sending to mongodb
-start_datetime_str = start_datetime.strftime("%Y-%m-%dT%H:%M:%S")
-end_datetime_str = end_datetime.strftime("%Y-%m-%dT%H:%M:%S")
-
-# Connect to MongoDB
-client = pymongo.MongoClient(st.secrets["mongo_uri"])
-db = client.fitness
-collection = db.garmin_connect
-
-# MongoDB datetime query
-query = {"session_mesgs.start_time": {"$gte": start_datetime_str, "$lt": end_datetime_str}}
-
-# Retrieve documents satisfying the query
-garmin_collection = list(collection.find(query))
-
-# Close the MongoDB connection
-client.close()
-
-# Process collection details (the code below assumes all `start_time` are in UTC)
-for i in range(len(garmin_collection) -1, -1, -1):
-    # Process each session message
-    session_messages = garmin_collection[i]["session_mesgs"][0]
-    if session_messages["sport"] == "running":
-        session_messages_utc = session_messages.copy()
-
-        # Parse the start time of the activity and make it timezone aware as UTC
-        session_messages['start_time'] = parse(session_messages['start_time']).replace(tzinfo=pytz.utc)
-        
-        # Now convert the start time from UTC to the selected local timezone
-        session_messages['start_time'] = session_messages['start_time'].astimezone(local_tz)
-        
-        # The activity title should be displayed using the local timezone:
-        activity_title = session_messages["start_time"].strftime('%Y-%m-%d %H:%M:%S') + "_" + \
-                     session_messages["sport"] + "_" + session_messages["sub_sport"]
-
-        records = pd.DataFrame(garmin_collection[i]["record_mesgs"])
-
-        # Convert 'timestamp' column to datetime objects with timezone
-        records['timestamp'] = records['timestamp'].apply(parse)
-
-        # Convert all timestamps in 'records' from UTC to the selected timezone
-        records['timestamp'] = records['timestamp'].dt.tz_convert(local_tz)
-
-        st.markdown(f"## {activity_title}")
-        # write utc time for reference
-        st.write(f"Start Time (UTC): {session_messages_utc['start_time']}")
-
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            # Convert Distance to km
-            km_distance = session_messages['total_distance'] / 1000
-            st.write(f"Distance: {km_distance:.2f}km")
-            # Convert Duration from seconds to hh:mm:ss
-            time_elapsed = pd.to_timedelta(session_messages['total_elapsed_time'], unit='s')
-            # Cleanup the time format (remove days)
-            time_elapsed = str(time_elapsed).split()[2]
-            # Remove stuff after seconds
-            time_elapsed = time_elapsed.split('.')[0]
-            st.write(f"Duration: {time_elapsed}")
-        with col2:
-            # Convert m/s to min/km
-            min_per_km = 1000 / session_messages['enhanced_avg_speed'] / 60
-            st.write(f"Average Speed: {min_per_km:.2f}min/km")
-            st.write(f"Average Cadence: {session_messages['avg_cadence']}rpm")
-        with col3:
-            st.write(f"Calories: {session_messages['total_calories']} kcal")
-            st.write(f"Average Temperature: {session_messages['avg_temperature']}°C")
-        with col4:
-            st.write(f"Total Ascent: {session_messages['total_ascent']}m")
-            st.write(f"Total Descent: {session_messages['total_descent']}m")
-
-        # Make zero values in 'enhanced_speed' column null
-        records['enhanced_speed'] = records['enhanced_speed'].replace(0, np.nan)
-        # Make zero values in 'cadence' column null
-        records['cadence'] = records['cadence'].replace(0, np.nan)
-
-        # Convert speed from m/s to min/km pace in datetime format (if the value is zero, make the value 0)
-        records['enhanced_speed'] = records['enhanced_speed'].apply(lambda x: 0 if x == 0 else 1000 / x / 60)
-
-        # Make any values above 11 min/km null
-        records['enhanced_speed'] = records['enhanced_speed'].apply(lambda x: np.nan if x > 12 else x)
-
-        # Create figure with secondary and tertiary y-axis using Plotly Graph Objects
-        fig = go.Figure()
-        
-        # Add traces for each series
-        fig.add_trace(go.Scatter(x=records['timestamp'], y=records['enhanced_speed'], name='Speed'))
-        fig.add_trace(go.Scatter(x=records['timestamp'], y=records['enhanced_altitude'], name='Altitude', yaxis='y2'))
-        fig.add_trace(go.Scatter(x=records['timestamp'], y=records['cadence'], name='Cadence (RPM)', yaxis='y3'))
-        
-        # Create axis objects
-        fig.update_layout(
-            xaxis=dict(domain=[0.3, 1], showgrid=False),
-            yaxis=dict(title='Speed (min/km)', position=0.1, autorange='reversed', showgrid=False),
-            yaxis2=dict(title='Altitude (m)', overlaying='y', side='left', position=0.2, showgrid=False),
-            yaxis3=dict(title='Cadence (RPM)', overlaying='y', side='right', showgrid=False)
-        )
-        
-        # Show the figure
-        st.plotly_chart(fig, use_container_width=True)
-        
-        #########################################################################
-        # Create a subset DataFrame where both latitude and longitude position is not null
-        records_subset = records.dropna(subset=['position_lat', 'position_long'])
-        
-        # Convert latitude and longitude from semicircles to degrees
-        records_subset['position_lat'] = records_subset['position_lat'] * (180 / 2**31)
-        records_subset['position_long'] = records_subset['position_long'] * (180 / 2**31)
-        
-        # Create a new map object centered at the mean of the latitude and longitude
-        center_lat = records_subset['position_lat'].mean()
-        center_long = records_subset['position_long'].mean()
-        
-        # Initialize the map with a more zoomed in value
-        zoom_start = 17  # Closer view where most of the route should be visible
-        
-        m = folium.Map(location=[center_lat, center_long], zoom_start=zoom_start)
-        
-        # Add the running route using a line to represent the path
-        folium.PolyLine(
-            list(zip(records_subset['position_lat'], records_subset['position_long'])),
-            weight=5,
-            color='blue',
-            line_opacity=0.8
-        ).add_to(m)
-        
-        # Display the interactive map in the Streamlit application
-        # Add scrollbar for width
-        folium_width = st.slider(f'Map Width_slider_{i}', 0, 2000, 1075)
-        folium_static(m, width=folium_width, height=500)
-        # folium_static(m)
+    #Start time from midnight, end time to midnight
+    st.time_input('Start Time', value=time(0, 0, 0), key='time_start')
+    st.time_input('End Time', value=time(23, 59, 59), key='time_end')
+
+# The activity summaries in the range (cached per date range)
+summaries = fetched.get('activities', [])
+instrument.count('activity summaries', len(summaries))
+
+# Activities are shown newest first, a page at a time
+summaries = summaries[::-1]
+page_count = max(1, math.ceil(len(summaries) / ACTIVITIES_PER_PAGE))
+page = st.number_input(f'Page (of {page_count})', min_value=1, max_value=page_count, value=1)
+page_summaries = summaries[(page - 1) * ACTIVITIES_PER_PAGE:page * ACTIVITIES_PER_PAGE]
+
+# Process activity summaries (the code below assumes all `start_time` are in UTC)
+# Convert the page's start times from UTC to the selected timezone in one pass
+page_start_times = activity.to_local(activity.epoch_seconds([summary['start_time'] for summary in page_summaries]),
+                                     selected_tz).astype(str)
+for summary, start_time in zip(page_summaries, page_start_times):
+    # The activity title should be displayed using the local timezone:
+    activity_title = start_time.replace('T', ' ') + "_" + summary["sport"] + "_" + summary["sub_sport"]
+
+    if summary["sport"] == "running":
+        # The route sits beside the collapsed expander, so the list shows every activity's route
+        thumbnail_col, expander_col = st.columns([1, 15])
+        with thumbnail_col:
+            # Route drawn at ingest time (see thumbnails.py), no map tiles needed
+            if summary.get('route_svg'):
+                st.image(summary['route_svg'], width=THUMBNAIL_WIDTH)
+        with expander_col:
+            with st.expander(activity_title):
+                # write utc time for reference
+                st.write(f"Start Time (UTC): {summary['start_time']}")
+
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    st.write(f"Distance: {summary['distance_km']:.2f}km")
+                    st.write(f"Duration: {activity.format_duration(summary['elapsed_time'])}")
+                with col2:
+                    st.write(f"Average Speed: {summary['avg_pace']:.2f}min/km")
+                    st.write(f"Average Cadence: {summary['avg_cadence']}rpm")
+                with col3:
+                    st.write(f"Calories: {summary['total_calories']} kcal")
+                    st.write(f"Average Temperature: {summary['avg_temperature']}°C")
+                with col4:
+                    st.write(f"Total Ascent: {summary['total_ascent']}m")
+                    st.write(f"Total Descent: {summary['total_descent']}m")
+
+                # Records, figure and map are only fetched and built when requested
+                if st.toggle('Show charts', key=f"records_{summary['_id']}"):
+                    # Built once per activity and timezone
+                    with instrument.span('activity figure'):
+                        fig = figures.running_figure(summary['start_time'], selected_tz)
+                    instrument.count_figure('activity figure', fig)
+                    st.plotly_chart(fig, use_container_width=True)
+
+                if st.toggle('Show interactive map', key=f"map_{summary['_id']}"):
+                    # Display the interactive map in the Streamlit application
+                    # Add scrollbar for width
+                    folium_width = st.slider('Map Width', 0, 2000, 1075, key=f"map_width_{summary['_id']}")
+                    with instrument.span('route map'):
+                        folium_static(figures.route_map(summary['start_time']), width=folium_width, height=500)
+#########################################################################
+    if (summary["sport"] == "cycling") & (summary["sub_sport"] == "indoor_cycling"):
+        with st.expander(activity_title):
+            # write utc time for reference
+            st.write(f"Start Time (UTC): {summary['start_time']}")
+
+            # Averages computed from the records at ingest time
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.write(f"Distance: {summary['distance_km']:.2f}km")
+                st.write(f"Duration: {activity.format_duration(summary['elapsed_time'])}")
+            with col2:
+                st.write(f"Average Speed: {summary['records_avg_speed']:.2f}km/h")
+                st.write(f"Average Cadence: {summary['records_avg_cadence']:.2f}rpm")
+            with col3:
+                st.write(f"Average Power: {summary['records_avg_power']:.2f}W")
+                st.write(f"Calories: {summary['total_calories']} kcal")
+
+            # Records and figure are only fetched and built when requested
+            if st.toggle('Show charts', key=f"records_{summary['_id']}"):
+                # Built once per activity and timezone
+                with instrument.span('activity figure'):
+                    fig = figures.cycling_figure(summary['start_time'], selected_tz)
+                instrument.count_figure('activity figure', fig)
+                st.plotly_chart(fig, use_container_width=True)
+
 #########################################################################
-    if (session_messages["sport"] == "cycling") & (session_messages["sub_sport"] == "indoor_cycling"):
-        session_messages_utc = session_messages.copy()
-
-        # Parse the start time of the activity and make it timezone aware as UTC
-        session_messages['start_time'] = parse(session_messages['start_time']).replace(tzinfo=pytz.utc)
-        
-        # Now convert the start time from UTC to the selected local timezone
-        session_messages['start_time'] = session_messages['start_time'].astimezone(local_tz)
-        
-        # The activity title should be displayed using the local timezone:
-        activity_title = session_messages["start_time"].strftime('%Y-%m-%d %H:%M:%S') + "_" + \
-                     session_messages["sport"] + "_" + session_messages["sub_sport"]
-
-        records = pd.DataFrame(garmin_collection[i]["record_mesgs"])
-
-        # Convert 'timestamp' column to datetime objects with timezone
-        records['timestamp'] = records['timestamp'].apply(parse)
-
-        # Convert all timestamps in 'records' from UTC to the selected timezone
-        records['timestamp'] = records['timestamp'].dt.tz_convert(local_tz)
-
-        # Convert speed from m/s to km/h
-        records['enhanced_speed'] = records['enhanced_speed'] * 3.6
-
-        # Calculate average power from records
-        average_power = records['power'].mean()
-
-        # Calculate average cadence from records
-        average_cadence = records['cadence'].mean()
-
-        # Calculate average speed from records
-        average_speed = records['speed'].mean()
-
-
-        st.markdown(f"## {activity_title}")
-        # write utc time for reference
-        st.write(f"Start Time (UTC): {session_messages_utc['start_time']}")
-
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            # Convert Distance to km
-            km_distance = session_messages['total_distance'] / 1000
-            st.write(f"Distance: {km_distance:.2f}km")
-            # Convert Duration from seconds to hh:mm:ss
-            time_elapsed = pd.to_timedelta(session_messages['total_elapsed_time'], unit='s')
-            # Cleanup the time format (remove days)
-            time_elapsed = str(time_elapsed).split()[2]
-            # Remove stuff after seconds
-            time_elapsed = time_elapsed.split('.')[0]
-            st.write(f"Duration: {time_elapsed}")
-        with col2:
-            st.write(f"Average Speed: {average_speed:.2f}km/h")
-            st.write(f"Average Cadence: {average_cadence:.2f}rpm")
-        with col3:
-            st.write(f"Average Power: {average_power:.2f}W")
-            st.write(f"Calories: {session_messages['total_calories']} kcal")
-
-        # Make zero values in 'enhanced_speed' column null
-        records['enhanced_speed'] = records['enhanced_speed'].replace(0, np.nan)
-        # Make zero values in 'cadence' column null
-        records['cadence'] = records['cadence'].replace(0, np.nan)
-
-        # Make zero values in 'power' column null
-        records['power'] = records['power'].replace(0, np.nan)
-        
-        # Create figure with secondary and tertiary y-axis using Plotly Graph Objects
-        fig = go.Figure()
-        
-        # Add traces for each series
-        fig.add_trace(go.Scatter(x=records['timestamp'], y=records['enhanced_speed'], name='Speed (km/h)'))
-        fig.add_trace(go.Scatter(x=records['timestamp'], y=records['power'], name='Power (W)', yaxis='y2'))
-        fig.add_trace(go.Scatter(x=records['timestamp'], y=records['cadence'], name='Cadence (RPM)', yaxis='y3'))
-        
-        # Create axis objects
-        fig.update_layout(
-            xaxis=dict(domain=[0.3, 1], showgrid=False),
-            yaxis=dict(title='Speed (km/h)', position=0.1, showgrid=False),
-            yaxis2=dict(title='Power (W)', overlaying='y', side='left', position=0.2, showgrid=False),
-            yaxis3=dict(title='Cadence (RPM)', overlaying='y', side='right', showgrid=False)
-        )
-        
-        # Display the figure
-        st.plotly_chart(fig, use_container_width=True)
+instrument.lap('activities')
+instrument.finish()
@@ -0,0 +1,79 @@
+"""Micro-benchmark of the record processing in activity.py.
+
+Compares the vectorized pipeline with the per-row `apply(parse)` and
+`apply(lambda ...)` code it replaced, on a synthetic 10k-row run.
+
+    python benchmarks/bench_activity.py [rows]
+"""
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+import pytz
+from dateutil.parser import parse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import activity
+
+
+def synthetic_records(rows):
+    # Record messages as they come back from Mongo, timestamps written with default=str
+    start = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+    rng = np.random.default_rng(0)
+    speed = np.clip(rng.normal(3.0, 0.6, rows), 0, None)
+    speed[rng.random(rows) < 0.02] = 0
+    return [{
+        'timestamp': str(start + timedelta(seconds=k)),
+        'position_lat': int(174184784 + k * 120),
+        'position_long': int(-1079707056 + k * 80),
+        'enhanced_speed': float(speed[k]),
+        'enhanced_altitude': 1500.0 + k % 40,
+        'cadence': 0 if speed[k] == 0 else 85,
+    } for k in range(rows)]
+
+
+def legacy(record_mesgs, local_tz):
+    records = pd.DataFrame(record_mesgs)
+    records['timestamp'] = records['timestamp'].apply(parse)
+    records['timestamp'] = records['timestamp'].dt.tz_convert(local_tz)
+    records['enhanced_speed'] = records['enhanced_speed'].replace(0, np.nan)
+    records['cadence'] = records['cadence'].replace(0, np.nan)
+    records['enhanced_speed'] = records['enhanced_speed'].apply(lambda x: 0 if x == 0 else 1000 / x / 60)
+    records['enhanced_speed'] = records['enhanced_speed'].apply(lambda x: np.nan if x > 12 else x)
+    records_subset = records.dropna(subset=['position_lat', 'position_long'])
+    records_subset['position_lat'] = records_subset['position_lat'] * (180 / 2**31)
+    records_subset['position_long'] = records_subset['position_long'] * (180 / 2**31)
+    return records, records_subset
+
+
+def vectorized(record_mesgs, tz_name):
+    records = activity.process_running(activity.load_records(record_mesgs))
+    return records, activity.to_local(records['timestamp'], tz_name), activity.route_degrees(records)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    record_mesgs = synthetic_records(rows)
+    local_tz = pytz.timezone('America/Guatemala')
+
+    # Both pipelines must agree before their timings mean anything
+    old_records, old_subset = legacy(record_mesgs, local_tz)
+    new_records, new_times, (new_lat, new_long) = vectorized(record_mesgs, local_tz.zone)
+    assert (old_records['timestamp'].dt.tz_localize(None).to_numpy() == new_times).all()
+    np.testing.assert_allclose(old_records['enhanced_speed'], new_records['enhanced_speed'])
+    np.testing.assert_allclose(old_subset['position_lat'], new_lat)
+
+    repeat = 5
+    old_time = min(timeit.repeat(lambda: legacy(record_mesgs, local_tz), number=1, repeat=repeat))
+    new_time = min(timeit.repeat(lambda: vectorized(record_mesgs, local_tz.zone), number=1, repeat=repeat))
+    print(f"{rows} records, best of {repeat}")
+    print(f"apply/parse: {old_time * 1000:8.2f} ms")
+    print(f"vectorized:  {new_time * 1000:8.2f} ms")
+    print(f"speedup:     {old_time / new_time:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
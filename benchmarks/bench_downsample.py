@@ -0,0 +1,76 @@
+"""Payload size and build time of an activity's chart and map, before and
+after downsampling with downsample.py.
+
+    python benchmarks/bench_downsample.py [hours]
+"""
+import os
+import sys
+import time
+
+import folium
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import downsample
+
+
+def synthetic_run(hours):
+    # 1 Hz samples of a wandering route with noisy pace, altitude and cadence
+    rows = int(hours * 3600)
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'timestamp': pd.date_range('2024-01-01 12:00', periods=rows, freq='s', tz='UTC'),
+        'enhanced_speed': np.clip(rng.normal(5.5, 0.4, rows), 3, 12),
+        'enhanced_altitude': 1500 + np.cumsum(rng.normal(0, 0.2, rows)),
+        'cadence': rng.normal(85, 3, rows).round(),
+        'position_lat': 14.6 + np.cumsum(rng.normal(2e-5, 1e-5, rows)),
+        'position_long': -90.5 + np.cumsum(rng.normal(0, 1e-5, rows)),
+    })
+
+
+def build_figure(traces):
+    fig = go.Figure()
+    for k, (name, (x, y)) in enumerate(traces.items()):
+        fig.add_trace(go.Scatter(x=x, y=y, name=name, yaxis=f'y{k + 1}' if k else 'y'))
+    return fig.to_json()
+
+
+def build_map(lat, long):
+    m = folium.Map(location=[lat.mean(), long.mean()], zoom_start=17)
+    folium.PolyLine(list(zip(lat, long)), weight=5, color='blue').add_to(m)
+    return m.get_root().render()
+
+
+def measure(build, *args):
+    started = time.perf_counter()
+    payload = build(*args)
+    return len(payload.encode()), time.perf_counter() - started
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    records = synthetic_run(hours)
+    columns = ['enhanced_speed', 'enhanced_altitude', 'cadence']
+    lat, long = records['position_lat'].to_numpy(), records['position_long'].to_numpy()
+
+    full_traces = {column: (records['timestamp'], records[column]) for column in columns}
+    started = time.perf_counter()
+    small_traces = downsample.downsample_traces(records, 'timestamp', columns)
+    small_lat, small_long = downsample.simplify_route(lat, long)
+    downsample_time = time.perf_counter() - started
+
+    results = [
+        ("figure", measure(build_figure, full_traces), measure(build_figure, small_traces)),
+        ("map", measure(build_map, lat, long), measure(build_map, small_lat, small_long)),
+    ]
+    print(f"{len(records)} records, downsampling took {downsample_time * 1000:.1f} ms")
+    for name, (full_bytes, full_time), (small_bytes, small_time) in results:
+        print(f"{name:7s} {full_bytes / 1e3:9.1f} kB {full_time * 1000:8.1f} ms -> "
+              f"{small_bytes / 1e3:8.1f} kB {small_time * 1000:8.1f} ms "
+              f"({full_bytes / small_bytes:.0f}x smaller)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""Synthetic activities, FIT files and local database stand-ins for the benchmarks.
+
+Nothing here needs Garmin exports or the cloud databases: activities are
+generated at realistic sizes, Postgres is replaced by SQLite (the tables
+live in an attached `fitness` database, so `fitness.weight` still works)
+and MongoDB by mongomock, or by a local mongod when BENCH_MONGO_URI is set.
+"""
+import os
+import sys
+import json
+import struct
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import rollup
+import migrate_dates
+
+SEMICIRCLES_PER_DEGREE = 2**31 / 180
+START = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+
+#########################################################################
+# Activities, shaped like the decoder output
+def synthetic_activity(seconds, sport='running', start=START, seed=0):
+    """A 1 Hz activity: a wandering GPS run, or an indoor ride with power."""
+    rng = np.random.default_rng(seed)
+    indoor = sport == 'cycling'
+    speed = np.clip(rng.normal(8.0 if indoor else 3.0, 0.5, seconds), 0, None)
+    speed[rng.random(seconds) < 0.01] = 0
+    distance = np.cumsum(speed)
+    altitude = 1500 + np.cumsum(rng.normal(0, 0.1, seconds))
+    heading = np.cumsum(rng.normal(0, 0.05, seconds))
+    lat = 14.6 + np.cumsum(speed * np.cos(heading)) / 111000
+    long = -90.5 + np.cumsum(speed * np.sin(heading)) / 108000
+    cadence = np.where(speed > 0, rng.normal(88, 4, seconds).round(), 0).astype(int)
+    power = np.where(speed > 0, rng.normal(190, 30, seconds).clip(0).round(), 0).astype(int)
+    heart_rate = rng.normal(145, 8, seconds).round().astype(int)
+
+    record_mesgs = []
+    for k in range(seconds):
+        record = {
+            'timestamp': start + timedelta(seconds=k),
+            'distance': round(float(distance[k]), 2),
+            'speed': round(float(speed[k]), 3),
+            'enhanced_speed': round(float(speed[k]), 3),
+            'enhanced_altitude': round(float(altitude[k]), 1),
+            'heart_rate': int(heart_rate[k]),
+            'cadence': int(cadence[k]),
+        }
+        if indoor:
+            record['power'] = int(power[k])
+        else:
+            record['position_lat'] = int(lat[k] * SEMICIRCLES_PER_DEGREE)
+            record['position_long'] = int(long[k] * SEMICIRCLES_PER_DEGREE)
+        record_mesgs.append(record)
+
+    # One lap per 10 minutes
+    lap_mesgs = []
+    for lap_start in range(0, seconds, 600):
+        lap_end = min(lap_start + 600, seconds) - 1
+        lap_mesgs.append({
+            'timestamp': start + timedelta(seconds=lap_end),
+            'start_time': start + timedelta(seconds=lap_start),
+            'total_elapsed_time': float(lap_end - lap_start + 1),
+            'total_timer_time': float(lap_end - lap_start + 1),
+            'total_distance': round(float(distance[lap_end] - (distance[lap_start - 1] if lap_start else 0)), 2),
+        })
+
+    session = {
+        'timestamp': start + timedelta(seconds=seconds),
+        'start_time': start,
+        'sport': sport,
+        'sub_sport': 'indoor_cycling' if indoor else 'generic',
+        'total_elapsed_time': float(seconds),
+        'total_timer_time': float(seconds),
+        'total_distance': round(float(distance[-1]), 2),
+        'total_calories': int(seconds / 6),
+        'avg_cadence': int(cadence.mean()),
+        'total_ascent': int(np.clip(np.diff(altitude), 0, None).sum()),
+        'total_descent': int(np.clip(-np.diff(altitude), 0, None).sum()),
+        'avg_temperature': 22,
+        'enhanced_avg_speed': round(float(speed.mean()), 3),
+    }
+    return {
+        'file_id_mesgs': [{'type': 'activity', 'manufacturer': 'garmin', 'product': 1,
+                           'serial_number': 3000000000 + seed, 'time_created': start}],
+        'record_mesgs': record_mesgs,
+        'lap_mesgs': lap_mesgs,
+        'session_mesgs': [session],
+    }
+
+
+def benchmark_activities():
+    """Runs from 30 minutes to 6 hours and indoor rides with power."""
+    activities = []
+    for k, (hours, sport) in enumerate([(0.5, 'running'), (1, 'running'), (2, 'running'), (6, 'running'),
+                                        (1, 'cycling'), (2, 'cycling')]):
+        start = START + timedelta(days=k)
+        activities.append((f"{sport}_{hours:g}h", synthetic_activity(int(hours * 3600), sport, start, seed=k)))
+    return activities
+
+
+def as_stored(messages):
+    """The activity as fit_json.py writes it (and as it sits in garmin_connect)."""
+    return json.loads(json.dumps(messages, default=str))
+
+#########################################################################
+# FIT encoding
+FIT_EPOCH = datetime(1989, 12, 31, tzinfo=timezone.utc)
+# Messages key -> (global message number, [(field, field number, struct format, base type, scale, offset)])
+FIT_FIELDS = {
+    'file_id_mesgs': (0, [('type', 0, 'B', 0x00, 1, 0), ('manufacturer', 1, 'H', 0x84, 1, 0),
+                          ('product', 2, 'H', 0x84, 1, 0), ('serial_number', 3, 'I', 0x8C, 1, 0),
+                          ('time_created', 4, 'I', 0x86, 1, 0)]),
+    'record_mesgs': (20, [('timestamp', 253, 'I', 0x86, 1, 0), ('position_lat', 0, 'i', 0x85, 1, 0),
+                          ('position_long', 1, 'i', 0x85, 1, 0), ('distance', 5, 'I', 0x86, 100, 0),
+                          ('heart_rate', 3, 'B', 0x02, 1, 0), ('cadence', 4, 'B', 0x02, 1, 0),
+                          ('power', 7, 'H', 0x84, 1, 0), ('speed', 6, 'H', 0x84, 1000, 0),
+                          ('enhanced_speed', 73, 'I', 0x86, 1000, 0),
+                          ('enhanced_altitude', 78, 'I', 0x86, 5, 500)]),
+    'lap_mesgs': (19, [('timestamp', 253, 'I', 0x86, 1, 0), ('start_time', 2, 'I', 0x86, 1, 0),
+                       ('total_elapsed_time', 7, 'I', 0x86, 1000, 0), ('total_timer_time', 8, 'I', 0x86, 1000, 0),
+                       ('total_distance', 9, 'I', 0x86, 100, 0)]),
+    'session_mesgs': (18, [('timestamp', 253, 'I', 0x86, 1, 0), ('start_time', 2, 'I', 0x86, 1, 0),
+                           ('sport', 5, 'B', 0x00, 1, 0), ('sub_sport', 6, 'B', 0x00, 1, 0),
+                           ('total_elapsed_time', 7, 'I', 0x86, 1000, 0), ('total_timer_time', 8, 'I', 0x86, 1000, 0),
+                           ('total_distance', 9, 'I', 0x86, 100, 0), ('total_calories', 11, 'H', 0x84, 1, 0),
+                           ('avg_cadence', 18, 'B', 0x02, 1, 0), ('total_ascent', 22, 'H', 0x84, 1, 0),
+                           ('total_descent', 23, 'H', 0x84, 1, 0), ('avg_temperature', 57, 'b', 0x01, 1, 0),
+                           ('enhanced_avg_speed', 124, 'I', 0x86, 1000, 0)]),
+}
+FIT_ENUMS = {'type': {'activity': 4}, 'manufacturer': {'garmin': 1},
+             'sport': {'running': 1, 'cycling': 2}, 'sub_sport': {'generic': 0, 'indoor_cycling': 6}}
+
+
+def _fit_value(name, value, scale, offset):
+    if isinstance(value, datetime):
+        return int((value - FIT_EPOCH).total_seconds())
+    if name in FIT_ENUMS:
+        return FIT_ENUMS[name][value]
+    return int(round((value + offset) * scale))
+
+
+def _encode_fit_directly(messages):
+    # Minimal little-endian FIT writer: one definition per message type
+    from garmin_fit_sdk.crc_calculator import CrcCalculator
+
+    body = bytearray()
+    for local_num, (mesgs_key, mesgs) in enumerate(messages.items()):
+        global_num, fields = FIT_FIELDS[mesgs_key]
+        fields = [field for field in fields if field[0] in mesgs[0]]
+        body += struct.pack('<BBBHB', 0x40 | local_num, 0, 0, global_num, len(fields))
+        for name, number, fmt, base_type, scale, offset in fields:
+            body += struct.pack('<BBB', number, struct.calcsize(fmt), base_type)
+        row = struct.Struct('<B' + ''.join(field[2] for field in fields))
+        for mesg in mesgs:
+            body += row.pack(local_num, *[_fit_value(name, mesg[name], scale, offset)
+                                          for name, _, _, _, scale, offset in fields])
+    header = bytearray(struct.pack('<BBHI4s', 14, 0x20, 2126, len(body), b'.FIT'))
+    header += struct.pack('<H', CrcCalculator.calculate_crc(header, 0, 12))
+    data = header + body
+    return bytes(data + struct.pack('<H', CrcCalculator.calculate_crc(data, 0, len(data))))
+
+
+def encode_fit(messages):
+    """Encodes an activity as FIT bytes.
+
+    Uses the SDK's Encoder when the installed garmin_fit_sdk has one (it was
+    added after the version pinned in requirements.txt), else a minimal writer.
+    """
+    try:
+        from garmin_fit_sdk import Encoder
+    except ImportError:
+        return _encode_fit_directly(messages)
+    encoder = Encoder()
+    for mesgs_key, mesgs in messages.items():
+        global_num = FIT_FIELDS[mesgs_key][0]
+        for mesg in mesgs:
+            encoder.on_mesg(global_num, mesg)
+    return encoder.close()
+
+#########################################################################
+# Postgres stand-in
+def weight_table(days, end=START.date()):
+    rng = np.random.default_rng(1)
+    return pd.DataFrame({
+        'date': pd.date_range(end=end, periods=days, freq='D').date,
+        'lbs': 125 + np.cumsum(rng.normal(0, 0.2, days)),
+        'caloric_intake': rng.normal(2100, 250, days).round(),
+        'cardio_calories': rng.normal(350, 120, days).clip(0).round(),
+        'run_kms': rng.normal(6, 2, days).clip(0).round(2),
+        'run_calories': rng.normal(400, 100, days).clip(0).round(),
+        'run_type': rng.choice(['easy', 'tempo', 'long'], days),
+        'bike_kms': rng.normal(15, 5, days).clip(0).round(2),
+        'bike_calories': rng.normal(300, 80, days).clip(0).round(),
+        'bike_type': rng.choice(['indoor', 'road'], days),
+    })
+
+
+def strength_table(days, sets_per_day=6, end=START.date()):
+    rng = np.random.default_rng(2)
+    rows = days * sets_per_day
+    return pd.DataFrame({
+        'date': np.repeat(pd.date_range(end=end, periods=days, freq='D').date, sets_per_day),
+        'exercise': rng.choice(['pull ups', 'push ups', 'dips', 'squats'], rows),
+        'variation': rng.choice(['standard', 'wide', 'weighted'], rows),
+        'reps': rng.integers(5, 25, rows),
+        'weight': rng.choice([0, 0, 10, 20], rows),
+    })
+
+
+def sqlite_fitness(days=3 * 365):
+    """An in-memory SQLite database with fitness.weight and fitness.strength."""
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    conn.execute("ATTACH DATABASE ':memory:' AS fitness")
+    # pandas ignores the schema on plain sqlite3 connections, so the tables are moved over
+    for name, table in [('weight', weight_table(days)), ('strength', strength_table(days))]:
+        table.to_sql(name, conn, index=False)
+        conn.execute(f"CREATE TABLE fitness.{name} AS SELECT * FROM main.{name}")
+        conn.execute(f"DROP TABLE main.{name}")
+    return conn
+
+#########################################################################
+# MongoDB stand-in
+def mongo_fitness(activities):
+    """A `fitness` database holding the activities and their summaries."""
+    uri = os.environ.get("BENCH_MONGO_URI")
+    if uri:
+        import pymongo
+        db = pymongo.MongoClient(uri).bench_fitness
+        db.garmin_connect.drop()
+        db.garmin_summaries.drop()
+    else:
+        import mongomock
+        db = mongomock.MongoClient().fitness
+    # Uploaded as text, then migrated to dates like the real collection
+    db.garmin_connect.insert_many([as_stored(messages) for _, messages in activities])
+    migrate_dates.migrate_activities(db.garmin_connect)
+    documents = list(db.garmin_connect.find())
+    rollup.upsert_summaries(db.garmin_summaries, [rollup.summarize_activity(document) for document in documents])
+    return db
@@ -0,0 +1,180 @@
+"""Offline benchmark suite for the conversion and dashboard pipeline.
+
+Runs every stage on the synthetic fixtures in fixtures.py and reports time,
+throughput and peak memory (tracemalloc) per stage and activity. Results
+are saved to benchmarks/results/ and compared with the previous run.
+
+    python benchmarks/run.py [--compare RESULTS_JSON] [--no-save]
+
+MongoDB is stood in for by mongomock unless BENCH_MONGO_URI points at a
+server, so install the benchmark requirements first:
+
+    pip install -r benchmarks/requirements.txt
+"""
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import fit_json
+import activity
+import figures
+import resample
+import rolling
+import data
+import fixtures
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def measure(function, *args):
+    """Returns the result, seconds and peak traced memory (MB) of `function(*args)`.
+
+    The function runs twice: timed without tracing, then traced for memory.
+    """
+    started = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - started
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak / 1e6
+
+
+def record(results, stage, name, seconds, peak_mb, **extra):
+    results[f"{stage}/{name}"] = {'seconds': seconds, 'peak_mb': peak_mb, **extra}
+    details = "".join(f" {key}={value:.1f}" for key, value in extra.items())
+    print(f"{stage:18s} {name:14s} {seconds * 1000:9.1f} ms {peak_mb:8.1f} MB{details}")
+
+
+def run_conversion(results, activities, output_dir):
+    for name, messages in activities:
+        fit_bytes = fixtures.encode_fit(messages)
+        megabytes = len(fit_bytes) / 1e6
+        records = len(messages['record_mesgs'])
+
+        (decoded, errors), seconds, peak = measure(fit_json.decode_fit, fit_bytes)
+        assert not errors, errors
+        record(results, "decode", name, seconds, peak, mb_per_s=megabytes / seconds, records_per_s=records / seconds)
+
+        json_path = os.path.join(output_dir, name + ".json")
+        _, seconds, peak = measure(fit_json.write_json, decoded, json_path)
+        record(results, "write json", name, seconds, peak, mb=os.path.getsize(json_path) / 1e6)
+
+        parquet_dir = os.path.join(output_dir, name)
+        _, seconds, peak = measure(fit_json.write_parquet, decoded, parquet_dir)
+        parquet_bytes = sum(os.path.getsize(path) for path in glob.glob(os.path.join(parquet_dir, "*")))
+        record(results, "write parquet", name, seconds, peak, mb=parquet_bytes / 1e6)
+
+
+def run_dashboard(results, activities):
+    db = fixtures.mongo_fitness(activities)
+    tz_name = 'America/Guatemala'
+
+    query = {"start_time": {"$gte": datetime(2000, 1, 1), "$lt": datetime(3000, 1, 1)}, "$or": data.SPORT_FILTER}
+    summaries, seconds, peak = measure(lambda: list(db.garmin_summaries.find(query).sort("start_time")))
+    record(results, "mongo summaries", "all", seconds, peak, activities=len(summaries))
+
+    for (name, _), summary in zip(activities, summaries):
+        document, seconds, peak = measure(db.garmin_connect.find_one,
+                                          {"start_time": summary['start_time']}, data.RECORD_PROJECTION)
+        record(results, "mongo records", name, seconds, peak)
+
+        records = activity.load_records(document['record_mesgs'])
+        (samples, _), seconds, peak = measure(resample.resample_records, records)
+        record(results, "resample records", name, seconds, peak, rows=len(samples))
+
+        # Building a figure modifies the samples, so every call starts from a fresh copy
+        def process():
+            if summary['sport'] == 'running':
+                return activity.process_running(samples.copy())
+            return activity.process_cycling(samples.copy())[0]
+
+        _, seconds, peak = measure(process)
+        record(results, "process records", name, seconds, peak)
+
+        def build_traces():
+            if summary['sport'] == 'running':
+                return figures.running_traces(samples.copy())
+            return figures.cycling_traces(samples.copy())
+
+        traces, seconds, peak = measure(build_traces)
+        record(results, "build traces", name, seconds, peak)
+
+        def build_figure():
+            if summary['sport'] == 'running':
+                return figures.build_running_figure(traces, tz_name).to_json()
+            return figures.build_cycling_figure(traces, tz_name).to_json()
+
+        # What a timezone switch costs once the traces are cached
+        figure_json, seconds, peak = measure(build_figure)
+        record(results, "build figure", name, seconds, peak, kb=len(figure_json) / 1e3)
+
+        if summary['sport'] == 'running':
+            def build_map():
+                return figures.build_route_map(samples).get_root().render()
+
+            map_html, seconds, peak = measure(build_map)
+            record(results, "build map", name, seconds, peak, kb=len(map_html) / 1e3)
+
+
+def run_tables(results):
+    conn = fixtures.sqlite_fitness()
+    df_weight, seconds, peak = measure(pd.read_sql, "SELECT * FROM fitness.weight ORDER BY date;", conn)
+    record(results, "sql weight", "3 years", seconds, peak, rows=len(df_weight))
+    df_strength, seconds, peak = measure(pd.read_sql, "SELECT * FROM fitness.strength ORDER BY date;", conn)
+    record(results, "sql strength", "3 years", seconds, peak, rows=len(df_strength))
+
+    _, seconds, peak = measure(lambda: rolling.RollingStats(rolling.WEIGHT_WINDOWS).update(df_weight))
+    record(results, "rolling stats", "full", seconds, peak)
+    stats = rolling.RollingStats(rolling.WEIGHT_WINDOWS)
+    stats.update(df_weight.iloc[:-1])
+    _, seconds, peak = measure(stats.update, df_weight)
+    record(results, "rolling stats", "one new day", seconds, peak)
+
+
+def compare(results, previous_path):
+    with open(previous_path) as previous_file:
+        previous = json.load(previous_file)['results']
+    print(f"\nCompared with {previous_path} (time ratio, <1 is faster):")
+    for key, entry in results.items():
+        if key in previous and previous[key]['seconds'] > 0:
+            ratio = entry['seconds'] / previous[key]['seconds']
+            print(f"{key:34s} {ratio:6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--compare", help="results file to compare with (default: the latest saved one)")
+    parser.add_argument("--no-save", action="store_true", help="do not save the results of this run")
+    args = parser.parse_args()
+
+    activities = fixtures.benchmark_activities()
+    results = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        run_conversion(results, activities, output_dir)
+    run_dashboard(results, activities)
+    run_tables(results)
+
+    previous_path = args.compare or max(glob.glob(os.path.join(RESULTS_DIR, "*.json")), default=None)
+    if previous_path:
+        compare(results, previous_path)
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+        with open(path, "w") as results_file:
+            json.dump({'time': datetime.now().isoformat(), 'results': results}, results_file, indent=1)
+        print(f"\nResults saved to '{path}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import pandas as pd
+import streamlit as st
+
+import pymongo
+from psycopg2 import pool
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+import activity
+import store
+
+# Seconds before a cached table is checked again for new rows
+TABLE_TTL = 300
+# Seconds before a cached activity query is sent to MongoDB again
+ACTIVITY_TTL = 600
+# Seconds the page waits for its startup queries before rendering without the slow ones
+FETCH_TIMEOUT = float(os.environ.get("FIT_APP_FETCH_TIMEOUT", 10))
+# Seconds a query may run on the server: late answers still fill the cache for the next
+# rerun, but a hung database cannot hold on to a pooled connection for ever
+QUERY_TIMEOUT = 3 * FETCH_TIMEOUT
+# FIT_APP_OFFLINE=1 reads activities from the local store (store.py) instead of MongoDB
+OFFLINE = os.environ.get("FIT_APP_OFFLINE", "") not in ("", "0")
+
+#########################################################################
+# Pooled connections, shared by every rerun and every session
+@st.cache_resource
+def get_pg_pool():
+    # Database connection parameters
+    db_params = {
+        'database': 'postgres',
+        'user': st.secrets["pg_username"],
+        'password': st.secrets["pg_password"],
+        'host': st.secrets["pg_host"],
+        'port': st.secrets["pg_port"],
+        'connect_timeout': max(2, round(FETCH_TIMEOUT)),
+        'options': f"-c statement_timeout={round(QUERY_TIMEOUT * 1000)}",
+    }
+    return pool.ThreadedConnectionPool(1, 4, **db_params)
+
+
+@st.cache_resource
+def get_mongo_client():
+    return pymongo.MongoClient(st.secrets["mongo_uri"],
+                               connectTimeoutMS=round(FETCH_TIMEOUT * 1000),
+                               serverSelectionTimeoutMS=round(FETCH_TIMEOUT * 1000),
+                               socketTimeoutMS=round(QUERY_TIMEOUT * 1000))
+
+
+def get_garmin_collection():
+    return get_mongo_client().fitness.garmin_connect
+
+
+def read_sql(query, params=None):
+    """Runs `query` on a pooled connection and returns a DataFrame."""
+    pg_pool = get_pg_pool()
+    conn = pg_pool.getconn()
+    try:
+        return pd.read_sql(query, conn, params=params)
+    finally:
+        pg_pool.putconn(conn)
+
+#########################################################################
+# Incrementally refreshed tables
+class TableCache:
+    """Holds the last loaded copy of a table and when it was refreshed."""
+
+    def __init__(self):
+        self.frame = None
+        self.refreshed_at = 0.0
+        self.lock = threading.Lock()
+
+
+@st.cache_resource
+def _table_cache(table, version):
+    return TableCache()
+
+
+def load_table(table, ttl=TABLE_TTL, version=0):
+    """Returns `table` ordered by date, only pulling rows newer than the cache.
+
+    Rows dated on the cached maximum are pulled again because the most recent
+    day is usually still being filled in. Bump `version` to force a full reload.
+    """
+    cache = _table_cache(table, version)
+    with cache.lock:
+        now = time.monotonic()
+        if cache.frame is None or cache.frame.empty:
+            cache.frame = read_sql(f"SELECT * FROM {table} ORDER BY date;")
+            cache.refreshed_at = now
+        elif now - cache.refreshed_at >= ttl:
+            last_date = cache.frame['date'].max()
+            new_rows = read_sql(f"SELECT * FROM {table} WHERE date >= %s ORDER BY date;", (last_date,))
+            kept_rows = cache.frame[cache.frame['date'] < last_date]
+            cache.frame = pd.concat([kept_rows, new_rows], ignore_index=True)
+            cache.refreshed_at = now
+        # Callers add derived columns, so never hand out the cached frame itself
+        return cache.frame.copy()
+
+
+def load_weight(**kwargs):
+    return load_table("fitness.weight", **kwargs)
+
+#########################################################################
+# Strength totals, grouped on the server so only one row per day/week and exercise is sent
+STRENGTH_PERIODS = ('day', 'week')
+
+
+@st.cache_data(ttl=TABLE_TTL, show_spinner=False)
+def table_columns(table):
+    schema, name = table.split(".")
+    columns = read_sql("SELECT column_name FROM information_schema.columns "
+                       "WHERE table_schema = %s AND table_name = %s;", (schema, name))
+    return set(columns['column_name'])
+
+
+@st.cache_data(ttl=TABLE_TTL, show_spinner=False)
+def load_strength_totals(period='day', start_date=None, end_date=None):
+    """Returns sets, reps and volume per exercise and variation for each day or week.
+
+    `start_date` and `end_date` (inclusive) limit the window. Volume is reps
+    times weight, and is only filled in when the table records a weight.
+    """
+    if period not in STRENGTH_PERIODS:
+        raise ValueError(f"Unknown period '{period}', expected one of {STRENGTH_PERIODS}")
+    volume = "SUM(reps * COALESCE(weight, 0))" if 'weight' in table_columns("fitness.strength") else "NULL"
+    conditions, params = [], {'period': period}
+    if start_date is not None:
+        conditions.append("date >= %(start_date)s")
+        params['start_date'] = start_date
+    if end_date is not None:
+        conditions.append("date <= %(end_date)s")
+        params['end_date'] = end_date
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f"""
+        SELECT date_trunc(%(period)s, date)::date AS date, exercise, variation,
+               COUNT(*) AS sets, SUM(reps) AS reps, {volume} AS volume
+        FROM fitness.strength {where}
+        GROUP BY 1, 2, 3
+        ORDER BY 1, 2, 3;"""
+    totals = read_sql(query, params)
+    totals['date'] = pd.to_datetime(totals['date'])
+    return totals
+
+#########################################################################
+# Activities: summaries are listed, records are only loaded when needed
+# Only these record fields are read by the dashboard, everything else stays on the server
+RECORD_FIELDS = ['timestamp', 'enhanced_speed', 'enhanced_altitude', 'speed', 'cadence', 'power',
+                 'position_lat', 'position_long']
+RECORD_PROJECTION = {"_id": 0, **{f"record_mesgs.{field}": 1 for field in RECORD_FIELDS}}
+# Summary fields the activity list shows (laps, stats and best efforts stay in the database)
+SUMMARY_FIELDS = ['start_time', 'sport', 'sub_sport', 'distance_km', 'elapsed_time', 'avg_pace', 'avg_cadence',
+                  'total_calories', 'avg_temperature', 'total_ascent', 'total_descent', 'records_avg_speed',
+                  'records_avg_cadence', 'records_avg_power', 'route_svg']
+SUMMARY_PROJECTION = {field: 1 for field in SUMMARY_FIELDS}
+# Sports the dashboard knows how to display
+SPORT_FILTER = [
+    {"sport": "running"},
+    {"sport": "cycling", "sub_sport": "indoor_cycling"},
+]
+BATCH_SIZE = 100
+
+
+def get_summary_collection():
+    return get_mongo_client().fitness.garmin_summaries
+
+
+def create_activity_indexes():
+    """Creates the indexes used by the summary listing and the records lookup."""
+    get_summary_collection().create_index([("start_time", pymongo.ASCENDING),
+                                           ("sport", pymongo.ASCENDING)])
+    # Top-level UTC start time, set by ingest.py and migrate_dates.py
+    get_garmin_collection().create_index([("start_time", pymongo.ASCENDING)])
+    # Lets ingest.py skip files that were already loaded
+    get_garmin_collection().create_index([("source_sha256", pymongo.ASCENDING)], sparse=True)
+
+
+@st.cache_data(ttl=ACTIVITY_TTL, show_spinner=False)
+def load_summaries(start_utc, end_utc):
+    """Returns the activity summaries (see rollup.py) that start in the UTC datetime range."""
+    if OFFLINE:
+        return store.load_summaries(start_utc, end_utc, SPORT_FILTER)
+    query = {"start_time": {"$gte": start_utc, "$lt": end_utc}, "$or": SPORT_FILTER}
+    cursor = get_summary_collection().find(query, SUMMARY_PROJECTION) \
+        .sort("start_time", pymongo.ASCENDING) \
+        .batch_size(BATCH_SIZE)
+    with cursor:
+        return list(cursor)
+
+
+@st.cache_data(ttl=ACTIVITY_TTL, show_spinner=False)
+def load_best_efforts():
+    """Returns the start time, sport and best efforts of every summarized activity."""
+    if OFFLINE:
+        return store.load_best_efforts()
+    projection = {"_id": 0, "start_time": 1, "sport": 1, "sub_sport": 1, "best_efforts": 1}
+    cursor = get_summary_collection().find({"best_efforts": {"$exists": True}}, projection) \
+        .batch_size(BATCH_SIZE * 10)
+    with cursor:
+        return list(cursor)
+
+
+@st.cache_data(ttl=ACTIVITY_TTL, show_spinner=False)
+def load_records(start_time):
+    """Returns the projected record messages of the activity starting at `start_time` (UTC)."""
+    document = get_garmin_collection().find_one({"start_time": start_time}, RECORD_PROJECTION)
+    return document.get("record_mesgs", []) if document else []
+
+
+def load_record_frame(start_time):
+    """Returns the records DataFrame (timestamps as UTC epoch seconds) of an activity.
+
+    Offline, the records are memory-mapped from the store instead of fetched.
+    """
+    if OFFLINE:
+        return store.load_records(start_time)
+    return activity.load_records(load_records(start_time))
+
+
+#########################################################################
+# Concurrent fetching: the queries wait on the network, so threads overlap them
+@st.cache_resource
+def _fetch_pool():
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="fetch")
+
+
+# Requests still running, by (function, args), shared by every session
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def fetch_all(requests, timeout=FETCH_TIMEOUT):
+    """Runs `{name: (function, args)}` at the same time and waits at most `timeout` seconds.
+
+    Returns `(results, errors)`: the result of every request that finished,
+    and an error message for every one that failed or is still running. A
+    request that timed out keeps running (up to QUERY_TIMEOUT on the server),
+    so its cached result is ready for a later rerun, and reruns meanwhile wait
+    on that same request instead of sending it again.
+    """
+    ctx = get_script_run_ctx()
+
+    def run(function, args):
+        # Lets cached functions and widgets called from the thread see the session
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return function(*args)
+
+    futures = {}
+    with _in_flight_lock:
+        for key in [key for key, future in _in_flight.items() if future.done()]:
+            del _in_flight[key]
+        for name, (function, args) in requests.items():
+            if (function, args) not in _in_flight:
+                _in_flight[function, args] = _fetch_pool().submit(run, function, args)
+            futures[name] = _in_flight[function, args]
+    wait(futures.values(), timeout=timeout)
+    results, errors = {}, {}
+    for name, future in futures.items():
+        if not future.done():
+            errors[name] = f"no answer after {timeout:.0f}s"
+        elif future.exception() is not None:
+            errors[name] = repr(future.exception())
+        else:
+            results[name] = future.result()
+    return results, errors
+
+
+def clear_caches():
+    """Drops every cached table and activity query."""
+    _table_cache.clear()
+    table_columns.clear()
+    load_strength_totals.clear()
+    load_summaries.clear()
+    load_best_efforts.clear()
+    load_records.clear()
+
+
+if __name__ == "__main__":
+    create_activity_indexes()
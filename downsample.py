@@ -0,0 +1,152 @@
+import heapq
+
+import numpy as np
+import pandas as pd
+
+# Point budgets per map route and per chart trace
+ROUTE_POINTS = 500
+CHART_POINTS = 1000
+
+#########################################################################
+# Time series: largest-triangle-three-buckets
+def lttb(x, y, n_out):
+    """Returns the indices of the `n_out` points LTTB keeps from `(x, y)`.
+
+    NaN samples rank below every real sample, so a bucket only keeps a NaN
+    (and the chart only shows a gap) when the whole bucket is missing.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # First and last points are always kept, the rest is split into buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    # Average point of every bucket, plus the last point as the final "bucket"
+    finite = np.isfinite(y[:-1])
+    counts = np.add.reduceat(finite, edges[:-1])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x = np.append(np.add.reduceat(x[:-1], edges[:-1]) / np.diff(edges), x[-1])
+        mean_y = np.append(np.add.reduceat(np.where(finite, y[:-1], 0), edges[:-1]) / counts, y[-1])
+
+    indices = np.empty(n_out, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_x, next_y = mean_x[bucket + 1], mean_y[bucket + 1]
+        bucket_x, bucket_y = x[start:end], y[start:end]
+        area = np.abs((x[a] - next_x) * (bucket_y - y[a]) - (x[a] - bucket_x) * (next_y - y[a]))
+        area[np.isnan(area)] = -1
+        a = start + int(area.argmax())
+        indices[bucket + 1] = a
+    return indices
+
+
+def downsample_traces(frame, x_column, y_columns, n_out=CHART_POINTS, keep=None):
+    """Returns `{y_column: (x, y)}` with every trace reduced to `n_out` points.
+
+    Rows where the boolean `keep` is true are kept on top of those, e.g. the
+    gap rows of resampled records, so the lines still break at every pause.
+    """
+    x = frame[x_column]
+    if pd.api.types.is_datetime64_any_dtype(x):
+        x_values = (x - x.iloc[0]).dt.total_seconds().to_numpy()
+    else:
+        x_values = x.to_numpy(dtype=float)
+    kept = np.flatnonzero(keep) if keep is not None else np.array([], dtype=int)
+    traces = {}
+    for column in y_columns:
+        indices = np.union1d(lttb(x_values, frame[column], n_out), kept)
+        traces[column] = (x.iloc[indices], frame[column].iloc[indices])
+    return traces
+
+#########################################################################
+# Routes: Douglas-Peucker and Visvalingam-Whyatt
+def planar(lat, long):
+    # Scale longitude so that distances are roughly equal in both directions
+    lat = np.asarray(lat, dtype=float)
+    long = np.asarray(long, dtype=float)
+    return long * np.cos(np.radians(np.nanmean(lat))), lat
+
+
+def douglas_peucker(lat, long, n_out=ROUTE_POINTS):
+    """Returns the sorted indices of the `n_out` points Douglas-Peucker keeps.
+
+    Segments are split farthest-point first, so the loop stops as soon as the
+    point budget is used instead of searching for a matching epsilon.
+    """
+    x, y = planar(lat, long)
+    n = len(x)
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+
+    def farthest(first, last):
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        inner_x, inner_y = x[first + 1:last] - x[first], y[first + 1:last] - y[first]
+        length = np.hypot(dx, dy)
+        if length == 0:
+            distances = np.hypot(inner_x, inner_y)
+        else:
+            distances = np.abs(dx * inner_y - dy * inner_x) / length
+        distances = np.nan_to_num(distances, nan=-1)
+        split = int(np.argmax(distances))
+        # heapq is a min-heap, so distances are pushed negated
+        return (-distances[split], first + 1 + split, first, last)
+
+    kept = [0, n - 1]
+    heap = [farthest(0, n - 1)]
+    while heap and len(kept) < n_out:
+        _, split, first, last = heapq.heappop(heap)
+        kept.append(split)
+        for segment in ((first, split), (split, last)):
+            if segment[1] - segment[0] > 1:
+                heapq.heappush(heap, farthest(*segment))
+    return np.sort(kept)
+
+
+def visvalingam(lat, long, n_out=ROUTE_POINTS):
+    """Returns the sorted indices left after removing the smallest-area points."""
+    x, y = planar(lat, long)
+    n = len(x)
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+
+    def area(i):
+        a, c = previous[i], following[i]
+        return abs((x[a] - x[i]) * (y[c] - y[i]) - (x[c] - x[i]) * (y[a] - y[i])) / 2
+
+    previous = np.arange(-1, n - 1)
+    following = np.arange(1, n + 1)
+    removed = np.zeros(n, dtype=bool)
+    inner = np.arange(1, n - 1)
+    areas = np.abs((x[inner - 1] - x[inner]) * (y[inner + 1] - y[inner])
+                   - (x[inner + 1] - x[inner]) * (y[inner - 1] - y[inner])) / 2
+    heap = list(zip(areas.tolist(), inner.tolist()))
+    heapq.heapify(heap)
+    current = dict(zip(inner.tolist(), areas.tolist()))
+
+    remaining = n
+    while remaining > n_out and heap:
+        point_area, i = heapq.heappop(heap)
+        # Skip entries made stale by an earlier removal
+        if removed[i] or current[i] != point_area:
+            continue
+        removed[i] = True
+        remaining -= 1
+        a, c = previous[i], following[i]
+        following[a], previous[c] = c, a
+        # Neighbours never get a smaller area than the point just removed
+        for j in (a, c):
+            if 0 < j < n - 1:
+                current[j] = max(area(j), point_area)
+                heapq.heappush(heap, (current[j], j))
+    return np.flatnonzero(~removed)
+
+
+def simplify_route(lat, long, n_out=ROUTE_POINTS, method=douglas_peucker):
+    """Returns the route reduced to at most `n_out` points."""
+    indices = method(lat, long, n_out)
+    return np.asarray(lat)[indices], np.asarray(long)[indices]
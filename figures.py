@@ -0,0 +1,168 @@
+import streamlit as st
+import plotly.graph_objects as go
+
+import folium
+
+import data
+import activity
+import downsample
+import instrument
+import resample
+
+# Built figures and maps kept in memory, so reopening an activity is instant
+MAX_CACHED = 64
+
+#########################################################################
+# Traces are downsampled once per activity against UTC epoch seconds, and only
+# their x values are shifted to the selected timezone when a figure is built
+RUNNING_SERIES = ['enhanced_speed', 'enhanced_altitude', 'cadence']
+CYCLING_SERIES = ['enhanced_speed', 'power', 'cadence']
+
+
+def running_traces(records):
+    """Downsampled pace, altitude and cadence of a run's records."""
+    # Convert speed to min/km pace, with zero speed/cadence and paces above 12 min/km as null
+    records = activity.process_running(records)
+    # Reduce each series to the chart's point budget (LTTB keeps the peaks and dips, and every gap row)
+    return downsample.downsample_traces(records, 'timestamp', RUNNING_SERIES, keep=records.get('gap'))
+
+
+def cycling_traces(records):
+    """Downsampled speed, power and cadence of an indoor ride's records."""
+    # Convert speed from m/s to km/h and make zero speed/cadence/power null
+    records, averages = activity.process_cycling(records)
+    # Reduce each series to the chart's point budget (LTTB keeps the peaks and dips, and every gap row)
+    return downsample.downsample_traces(records, 'timestamp', CYCLING_SERIES, keep=records.get('gap'))
+
+
+def local_trace(traces, column, tz_name):
+    x, y = traces[column]
+    return activity.to_local(x, tz_name), y
+
+
+def build_running_figure(traces, tz_name):
+    """Speed, altitude and cadence figure of a run's traces, in `tz_name` time."""
+    # Create figure with secondary and tertiary y-axis using Plotly Graph Objects
+    fig = go.Figure()
+
+    # Add traces for each series
+    x, y = local_trace(traces, 'enhanced_speed', tz_name)
+    fig.add_trace(go.Scatter(x=x, y=y, name='Speed'))
+    x, y = local_trace(traces, 'enhanced_altitude', tz_name)
+    fig.add_trace(go.Scatter(x=x, y=y, name='Altitude', yaxis='y2'))
+    x, y = local_trace(traces, 'cadence', tz_name)
+    fig.add_trace(go.Scatter(x=x, y=y, name='Cadence (RPM)', yaxis='y3'))
+
+    # Create axis objects
+    fig.update_layout(
+        xaxis=dict(domain=[0.3, 1], showgrid=False),
+        yaxis=dict(title='Speed (min/km)', position=0.1, autorange='reversed', showgrid=False),
+        yaxis2=dict(title='Altitude (m)', overlaying='y', side='left', position=0.2, showgrid=False),
+        yaxis3=dict(title='Cadence (RPM)', overlaying='y', side='right', showgrid=False)
+    )
+    return fig
+
+
+def build_cycling_figure(traces, tz_name):
+    """Speed, power and cadence figure of an indoor ride's traces, in `tz_name` time."""
+    # Create figure with secondary and tertiary y-axis using Plotly Graph Objects
+    fig = go.Figure()
+
+    # Add traces for each series
+    x, y = local_trace(traces, 'enhanced_speed', tz_name)
+    fig.add_trace(go.Scatter(x=x, y=y, name='Speed (km/h)'))
+    x, y = local_trace(traces, 'power', tz_name)
+    fig.add_trace(go.Scatter(x=x, y=y, name='Power (W)', yaxis='y2'))
+    x, y = local_trace(traces, 'cadence', tz_name)
+    fig.add_trace(go.Scatter(x=x, y=y, name='Cadence (RPM)', yaxis='y3'))
+
+    # Create axis objects
+    fig.update_layout(
+        xaxis=dict(domain=[0.3, 1], showgrid=False),
+        yaxis=dict(title='Speed (km/h)', position=0.1, showgrid=False),
+        yaxis2=dict(title='Power (W)', overlaying='y', side='left', position=0.2, showgrid=False),
+        yaxis3=dict(title='Cadence (RPM)', overlaying='y', side='right', showgrid=False)
+    )
+    return fig
+
+
+def build_route_map(records):
+    """Folium map of the route in an activity's records."""
+    # Latitude and longitude in degrees where both positions are not null
+    route_lat, route_long = activity.route_degrees(records)
+
+    # Create a new map object centered at the mean of the latitude and longitude
+    center_lat = route_lat.mean()
+    center_long = route_long.mean()
+
+    # Simplify the route to the map's point budget
+    route_lat, route_long = downsample.simplify_route(route_lat, route_long)
+
+    # Initialize the map with a more zoomed in value
+    zoom_start = 17  # Closer view where most of the route should be visible
+
+    m = folium.Map(location=[center_lat, center_long], zoom_start=zoom_start)
+
+    # Add the running route using a line to represent the path
+    folium.PolyLine(
+        list(zip(route_lat, route_long)),
+        weight=5,
+        color='blue',
+        line_opacity=0.8
+    ).add_to(m)
+    return m
+
+#########################################################################
+# Traces and maps are memoized per activity, figures per activity and timezone,
+# so switching the timezone only shifts the cached traces
+def fetch_records(start_time):
+    # Timestamps are UTC epoch seconds, parsed in one pass (or already stored that way offline)
+    records = data.load_record_frame(start_time)
+    instrument.count('record rows', len(records))
+    return records
+
+
+@st.cache_resource(max_entries=MAX_CACHED, show_spinner=False)
+def activity_samples(start_time):
+    """Cleaned records of an activity on a regular grid, which every chart and map is built from."""
+    samples, _ = resample.resample_records(fetch_records(start_time))
+    return samples
+
+
+@st.cache_resource(max_entries=MAX_CACHED, show_spinner=False)
+def activity_running_traces(start_time):
+    # The per-sport processing writes to its frame, so it gets a copy of the shared samples
+    return running_traces(activity_samples(start_time).copy())
+
+
+@st.cache_resource(max_entries=MAX_CACHED, show_spinner=False)
+def activity_cycling_traces(start_time):
+    return cycling_traces(activity_samples(start_time).copy())
+
+
+@st.cache_resource(max_entries=MAX_CACHED, show_spinner=False)
+def running_figure(start_time, tz_name):
+    """Speed, altitude and cadence of the run starting at `start_time`."""
+    return build_running_figure(activity_running_traces(start_time), tz_name)
+
+
+@st.cache_resource(max_entries=MAX_CACHED, show_spinner=False)
+def cycling_figure(start_time, tz_name):
+    """Speed, power and cadence of the indoor ride starting at `start_time`."""
+    return build_cycling_figure(activity_cycling_traces(start_time), tz_name)
+
+
+@st.cache_resource(max_entries=MAX_CACHED, show_spinner=False)
+def route_map(start_time):
+    """Folium map of the route of the activity starting at `start_time`."""
+    return build_route_map(activity_samples(start_time))
+
+
+def clear_caches():
+    """Drops every built figure and map."""
+    activity_samples.clear()
+    activity_running_traces.clear()
+    activity_cycling_traces.clear()
+    running_figure.clear()
+    cycling_figure.clear()
+    route_map.clear()
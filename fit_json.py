@@ -1,40 +1,533 @@
 import sys
 import os
-from garmin_fit_sdk import Decoder, Stream
+import glob
+import time
 import json
+import hashlib
+import zipfile
+import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from garmin_fit_sdk import Decoder, Stream, Profile
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.feather as feather
+
+# Name of the file that remembers which FIT contents were already converted
+MANIFEST_NAME = ".fit_json_manifest.json"
+
+def decode_fit(fit_bytes):
+    # Decode the FIT file from memory
+    stream = Stream.from_byte_array(bytearray(fit_bytes))
+    decoder = Decoder(stream)
+    messages, errors = decoder.read()
+    stream.close()
+    return messages, errors
+
+def write_json(messages, output_json_path):
+    # Stream the JSON straight to the file instead of building the string first
+    with open(output_json_path, 'w') as json_file:
+        json.dump(messages, json_file, default=str)
 
 def convert_fit_to_json(fit_file_path, output_json_path):
     # Load the .fit file
-    stream = Stream.from_file(fit_file_path)
-    decoder = Decoder(stream)
+    with open(fit_file_path, 'rb') as fit_file:
+        fit_bytes = fit_file.read()
 
     # Decode the FIT file
-    messages, errors = decoder.read()
+    messages, errors = decode_fit(fit_bytes)
 
     # Handle any errors during decoding
     if errors:
         print("Errors encountered:", errors)
         return
 
-    # Convert the decoded data to JSON format
-    json_data = json.dumps(messages, default=str)
-
     # Save the JSON data to a file
-    with open(output_json_path, 'w') as json_file:
-        json.dump(messages, json_file, default=str)
+    write_json(messages, output_json_path)
 
     print(f"Conversion complete. JSON data saved to '{output_json_path}'.")
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python fit_json.py <path_to_fit_file>")
-        sys.exit(1)
+#########################################################################
+# Columnar output, one table per message type
+# Semicircle positions fit exactly in int32, so they are never converted
+SEMICIRCLE_FIELDS = {'position_lat', 'position_long', 'start_position_lat', 'start_position_long',
+                     'end_position_lat', 'end_position_long', 'nec_lat', 'nec_long', 'swc_lat', 'swc_long'}
+
+def column_type(name, values):
+    present = [value for value in values if value is not None]
+    if name in SEMICIRCLE_FIELDS:
+        return pa.int32()
+    if not present:
+        return pa.null()
+    if all(isinstance(value, datetime) for value in present):
+        return pa.timestamp('s', tz='UTC')
+    if all(isinstance(value, bool) for value in present):
+        return pa.bool_()
+    if all(isinstance(value, int) and not isinstance(value, bool) for value in present):
+        low, high = min(present), max(present)
+        if -2**15 <= low and high < 2**15:
+            return pa.int16()
+        if -2**31 <= low and high < 2**31:
+            return pa.int32()
+        return pa.int64()
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+        return pa.float32()
+    return pa.string()
+
+def messages_to_table(mesgs):
+    # Keep the column order in which fields first appear
+    names = list(dict.fromkeys(name for mesg in mesgs for name in mesg))
+    columns = {}
+    for name in names:
+        values = [mesg.get(name) for mesg in mesgs]
+        value_type = column_type(name, values)
+        if value_type == pa.string():
+            # Lists, dicts and enums that are not strings are kept as JSON text
+            values = [value if value is None or isinstance(value, str) else json.dumps(value, default=str)
+                      for value in values]
+        columns[name] = pa.array(values, type=value_type)
+    return pa.table(columns)
+
+def write_tables(messages, output_dir, write_table, extension):
+    os.makedirs(output_dir, exist_ok=True)
+    for mesgs_key, mesgs in messages.items():
+        if mesgs:
+            write_table(messages_to_table(mesgs), os.path.join(output_dir, mesgs_key + extension))
+
+def write_parquet(messages, output_dir):
+    # Smallest on disk, good for archiving and syncing
+    write_tables(messages, output_dir,
+                 lambda table, path: pq.write_table(table, path, compression='zstd'), ".parquet")
+
+def write_arrow(messages, output_dir):
+    # Uncompressed Arrow IPC, loads zero-copy through a memory map
+    write_tables(messages, output_dir,
+                 lambda table, path: feather.write_feather(table, path, compression='uncompressed'), ".arrow")
+
+def read_tables(output_dir, mesgs_keys=None):
+    """Loads the tables written by `write_parquet`, `write_arrow` or a streamed conversion.
+
+    Arrow files are memory-mapped, so their columns are not copied into memory.
+    Streamed message types may span several part files, which are concatenated.
+    """
+    parts = {}
+    for file_name in os.listdir(output_dir):
+        stem, extension = os.path.splitext(file_name)
+        # Parts after the first are named like record_mesgs.1.parquet
+        mesgs_key, _, part = stem.partition(".")
+        if mesgs_keys is not None and mesgs_key not in mesgs_keys:
+            continue
+        path = os.path.join(output_dir, file_name)
+        if extension == ".arrow":
+            table = feather.read_table(path, memory_map=True)
+        elif extension == ".parquet":
+            table = pq.read_table(path, memory_map=True)
+        else:
+            continue
+        parts.setdefault(mesgs_key, []).append((int(part or 0), table))
+
+    tables = {}
+    for mesgs_key in sorted(parts):
+        ordered = [table for _, table in sorted(parts[mesgs_key], key=lambda item: item[0])]
+        tables[mesgs_key] = ordered[0] if len(ordered) == 1 else pa.concat_tables(ordered, promote_options="permissive")
+    return tables
+
+# Output format -> (extension added to the output base name, writer)
+OUTPUT_FORMATS = {
+    'json': (".json", write_json),
+    'parquet': ("", write_parquet),
+    'arrow': ("", write_arrow),
+}
+
+#########################################################################
+# Streaming conversion, memory stays constant however long the activity is
+# Messages buffered per type before they are written out
+CHUNK_SIZE = 10000
+# The decoder looks these up while decoding developer fields, so it must keep them
+DECODER_STATE_KEYS = {'developer_data_id_mesgs', 'field_description_mesgs'}
+# Output format -> extension added to the output base name when streaming
+STREAM_EXTENSIONS = {'json': ".jsonl", 'parquet': "", 'arrow': ""}
+
+def parse_keep(specs):
+    """Parses `mesgs_key[:field,...]` specs into {mesgs_key: set of fields, or None for all}."""
+    if not specs:
+        return None
+    keep = {}
+    for spec in specs:
+        mesgs_key, _, fields = spec.partition(":")
+        keep[mesgs_key] = {field for field in fields.split(",") if field} or None
+    return keep
+
+class TableStream:
+    """Appends chunks of one message type to Parquet or Arrow files.
+
+    The schema comes from the first chunk. A chunk that does not fit it (a
+    field that only shows up later, like positions once GPS locks) starts a
+    new part file, which `read_tables` concatenates back.
+    """
+
+    def __init__(self, output_dir, mesgs_key, output_format):
+        self.output_dir = output_dir
+        self.mesgs_key = mesgs_key
+        self.output_format = output_format
+        self.parts = 0
+        self.writer = None
+        self.schema = None
+
+    def open(self, schema):
+        self.close()
+        suffix = f".{self.parts}" if self.parts else ""
+        extension = ".parquet" if self.output_format == 'parquet' else ".arrow"
+        path = os.path.join(self.output_dir, self.mesgs_key + suffix + extension)
+        if self.output_format == 'parquet':
+            self.writer = pq.ParquetWriter(path, schema, compression='zstd')
+        else:
+            self.writer = pa.ipc.new_file(path, schema)
+        self.schema = schema
+        self.parts += 1
+
+    def fit_schema(self, table):
+        """Returns `table` cast to the current schema, or None if it does not fit."""
+        if self.schema is None or not set(table.column_names) <= set(self.schema.names):
+            return None
+        for field in self.schema:
+            if field.name not in table.column_names:
+                table = table.append_column(field.name, pa.nulls(len(table), type=field.type))
+        try:
+            return table.select(self.schema.names).cast(self.schema)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            return None
+
+    def write(self, table):
+        fitted = self.fit_schema(table)
+        if fitted is None:
+            self.open(table.schema)
+            fitted = table
+        self.writer.write_table(fitted)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+class StreamWriter:
+    """Buffers decoded messages per type and writes them out a chunk at a time.
+
+    `keep` limits the output to some message types, and optionally to some of
+    their fields, as returned by `parse_keep`.
+    """
+
+    def __init__(self, output_path, output_format, keep=None, chunk_size=CHUNK_SIZE):
+        self.output_path = output_path
+        self.output_format = output_format
+        self.keep = keep
+        self.chunk_size = chunk_size
+        self.buffers = {}
+        self.counts = {}
+        if output_format == 'json':
+            # One {mesgs_key: message} object per line
+            self.json_file = open(output_path, 'w')
+        else:
+            os.makedirs(output_path, exist_ok=True)
+            self.tables = {}
+
+    def add(self, mesgs_key, message):
+        if self.keep is not None:
+            if mesgs_key not in self.keep:
+                return
+            fields = self.keep[mesgs_key]
+            if fields is not None:
+                message = {name: value for name, value in message.items() if name in fields}
+        buffer = self.buffers.setdefault(mesgs_key, [])
+        buffer.append(message)
+        self.counts[mesgs_key] = self.counts.get(mesgs_key, 0) + 1
+        if len(buffer) >= self.chunk_size:
+            self.flush(mesgs_key)
 
-    fit_file_path = sys.argv[1]  # First command line argument
-    base_name = os.path.splitext(fit_file_path)[0]
-    output_json_path = base_name + ".json"  # Output JSON file with same base name
+    def flush(self, mesgs_key):
+        mesgs = self.buffers.pop(mesgs_key, None)
+        if not mesgs:
+            return
+        if self.output_format == 'json':
+            self.json_file.writelines(json.dumps({mesgs_key: mesg}, default=str) + "\n" for mesg in mesgs)
+            return
+        if mesgs_key not in self.tables:
+            self.tables[mesgs_key] = TableStream(self.output_path, mesgs_key, self.output_format)
+        self.tables[mesgs_key].write(messages_to_table(mesgs))
 
-    convert_fit_to_json(fit_file_path, output_json_path)
+    def close(self):
+        for mesgs_key in list(self.buffers):
+            self.flush(mesgs_key)
+        if self.output_format == 'json':
+            self.json_file.close()
+        else:
+            for table in self.tables.values():
+                table.close()
+
+def stream_fit(fit_bytes, writer):
+    """Decodes `fit_bytes`, handing each message to `writer` as soon as it is read.
+
+    The raw file is small next to its decoded messages, which are dropped from
+    the decoder once written, so memory does not grow with the record count.
+    Heart rates are not merged into the records, since that needs them all.
+
+    Dropping them relies on SDK internals (the decoder's private `_messages`
+    lists, appended to before the listener is called). If a garmin_fit_sdk
+    release changes that, nothing is dropped and memory grows as in `decode_fit`.
+    """
+    def on_message(mesg_num, message):
+        if mesg_num in Profile['messages']:
+            mesgs_key = Profile['messages'][mesg_num]['messages_key']
+        else:
+            mesgs_key = str(mesg_num)
+        writer.add(mesgs_key, message)
+        if mesgs_key in DECODER_STATE_KEYS:
+            return
+        # Only the message just handed to us is dropped, never one the decoder still needs
+        decoded = (getattr(decoder, '_messages', None) or {}).get(mesgs_key)
+        if decoded and decoded[-1] is message:
+            decoded.pop()
+
+    stream = Stream.from_byte_array(bytearray(fit_bytes))
+    decoder = Decoder(stream)
+    try:
+        _, errors = decoder.read(merge_heart_rates=False, mesg_listener=on_message)
+    finally:
+        writer.close()
+        stream.close()
+    return errors
+
+def convert_fit_streaming(fit_file_path, output_path, output_format='json', keep=None, chunk_size=CHUNK_SIZE):
+    """Like `convert_fit_to_json`, but writes JSON lines (or Parquet/Arrow) while decoding."""
+    with open(fit_file_path, 'rb') as fit_file:
+        fit_bytes = fit_file.read()
+
+    errors = stream_fit(fit_bytes, StreamWriter(output_path, output_format, keep, chunk_size))
+    if errors:
+        print("Errors encountered:", errors)
+        return
+
+    print(f"Conversion complete. Data streamed to '{output_path}'.")
+
+#########################################################################
+# Batch conversion
+def find_fit_sources(paths, output_dir=None):
+    """Expands files, directories, globs and zip archives into FIT sources.
+
+    Each source is a `(path, member, output_base)` tuple, where `member` is
+    the name of the FIT file inside the zip archive at `path` (or None) and
+    `output_base` is the output path without the format's extension.
+    """
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = sorted(glob.glob(os.path.join(path, "**", "*"), recursive=True))
+        else:
+            matches = sorted(glob.glob(path, recursive=True)) or [path]
+        for match in matches:
+            extension = os.path.splitext(match)[1].lower()
+            if extension == ".zip":
+                # FIT members are read straight out of the archive later
+                with zipfile.ZipFile(match) as archive:
+                    members = [name for name in archive.namelist() if name.lower().endswith(".fit")]
+                for member in members:
+                    base_name = os.path.splitext(os.path.basename(member))[0]
+                    directory = output_dir or os.path.dirname(match)
+                    sources.append((match, member, os.path.join(directory, base_name)))
+            elif extension == ".fit":
+                base_name = os.path.splitext(match)[0]
+                if output_dir:
+                    base_name = os.path.join(output_dir, os.path.basename(base_name))
+                sources.append((match, None, base_name))
+
+    # Same-named files from other folders or archives get their own output
+    seen = set()
+    for i, (path, member, output_base) in enumerate(sources):
+        if output_base in seen:
+            output_base += "-" + hashlib.sha256(f"{path}:{member}".encode()).hexdigest()[:8]
+            sources[i] = (path, member, output_base)
+        seen.add(output_base)
+    return sources
+
+def read_source(path, member):
+    if member is None:
+        with open(path, 'rb') as fit_file:
+            return fit_file.read()
+    with zipfile.ZipFile(path) as archive:
+        return archive.read(member)
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)
+
+def save_manifest(manifest, manifest_path):
+    with open(manifest_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+
+def output_variant(output_format, stream=False, keep=None):
+    """Label of an output flavour, so the same contents converted another way is not a duplicate."""
+    if not stream:
+        return output_format
+    if keep is None:
+        return output_format + "+stream"
+    kept = ";".join(f"{key}:{','.join(sorted(fields or []))}" for key, fields in sorted(keep.items()))
+    return f"{output_format}+stream[{kept}]"
+
+_worker_settings = {}
+
+def _init_worker(settings):
+    global _worker_settings
+    _worker_settings = settings
+
+def _run_source(function, source):
+    try:
+        return function(source, **_worker_settings)
+    except Exception as error:
+        # An unreadable file fails on its own instead of stopping the whole batch
+        return {'source': source, 'errors': [repr(error)], 'skipped': False}
+
+def process_sources(function, sources, jobs=None, **settings):
+    """Runs `function(source, **settings)` on every source across a process pool.
+
+    Yields each result as soon as it is done. At most two sources per worker
+    are in flight at any time, so memory stays bounded no matter how many
+    files there are. A source whose `function` raises yields a result with
+    its `errors` instead of stopping the others.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    # The settings are sent once per worker instead of with every source
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(settings,)) as executor:
+        pending = set()
+        queued = iter(sources)
+        while True:
+            for source in queued:
+                pending.add(executor.submit(_run_source, function, source))
+                if len(pending) >= jobs * 2:
+                    break
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+def _convert_source(source, known_hashes, claimed_outputs, output_format, stream, keep, store_dir):
+    path, member, output_base = source
+    extension, write_output = OUTPUT_FORMATS[output_format]
+    if stream:
+        extension = STREAM_EXTENSIONS[output_format]
+    output_path = output_base + extension
+    started = time.perf_counter()
+    fit_bytes = read_source(path, member)
+    digest = output_variant(output_format, stream, keep) + ":" + hashlib.sha256(fit_bytes).hexdigest()
+    result = {'source': source, 'hash': digest, 'bytes': len(fit_bytes), 'errors': None, 'skipped': False}
+
+    # Skip contents that were already converted to a file that still exists
+    if os.path.exists(known_hashes.get(digest, "")):
+        result['skipped'] = True
+        result['output'] = known_hashes[digest]
+        return result
+    # An earlier run wrote another activity under this name, so it is not overwritten
+    if claimed_outputs.get(output_path, digest) != digest and os.path.exists(output_path):
+        output_path = f"{output_base}-{digest.rsplit(':', 1)[1][:8]}{extension}"
+
+    if stream:
+        writer = StreamWriter(output_path, output_format, keep)
+        errors = stream_fit(fit_bytes, writer)
+        records = writer.counts.get('record_mesgs', 0)
+    else:
+        messages, errors = decode_fit(fit_bytes)
+        records = len(messages.get('record_mesgs', []))
+    if errors:
+        result['errors'] = [str(error) for error in errors]
+        return result
+
+    if not stream:
+        write_output(messages, output_path)
+        if store_dir and messages.get('session_mesgs'):
+            # Imported here, the store pulls in the summary code the converter doesn't otherwise need
+            import store
+            store.add_activity(messages, store_dir)
+    result['output'] = output_path
+    result['records'] = records
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+def convert_fit_files(paths, output_dir=None, manifest_path=MANIFEST_NAME, jobs=None, force=False,
+                      output_format='json', stream=False, keep=None, store_dir=None):
+    """Converts every FIT file found in `paths` across a process pool (see `process_sources`).
+
+    With `stream`, each file
+    is also written while it is decoded (see `stream_fit`). With `store_dir`,
+    each activity is added to that local activity store too (see store.py).
+    """
+    sources = find_fit_sources(paths, output_dir)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    # With `force` nothing is skipped, but the manifest keeps the entries of earlier runs
+    manifest = load_manifest(manifest_path)
+
+    started = time.perf_counter()
+    total_bytes = 0
+    converted = skipped = failed = 0
+    # The files converted so far are recorded even if the run is interrupted
+    try:
+        results = process_sources(_convert_source, sources, jobs,
+                                  known_hashes={} if force else manifest,
+                                  # Outputs written by earlier runs, and the contents they hold
+                                  claimed_outputs={output: digest for digest, output in manifest.items()},
+                                  output_format=output_format, stream=stream, keep=keep, store_dir=store_dir)
+        for result in results:
+            path, member, output_base = result['source']
+            name = f"{path}:{member}" if member else path
+            if result['skipped']:
+                skipped += 1
+                print(f"Skipped {name}, already converted to '{result['output']}'.")
+            elif result['errors']:
+                failed += 1
+                print(f"Errors encountered in {name}:", result['errors'])
+            else:
+                converted += 1
+                total_bytes += result['bytes']
+                manifest[result['hash']] = result['output']
+                megabytes = result['bytes'] / 1e6
+                print(f"Converted {name} -> '{result['output']}': {megabytes:.2f} MB, "
+                      f"{result['records']} records in {result['seconds']:.2f}s "
+                      f"({megabytes / result['seconds']:.2f} MB/s)")
+    finally:
+        save_manifest(manifest, manifest_path)
+    elapsed = time.perf_counter() - started
+    print(f"{converted} converted, {skipped} skipped, {failed} failed in {elapsed:.2f}s "
+          f"({total_bytes / 1e6 / max(elapsed, 1e-9):.2f} MB/s)")
+    return converted, skipped, failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert Garmin .fit files to JSON, Parquet or Arrow.")
+    parser.add_argument("paths", nargs="+", help=".fit files, directories, glob patterns or .zip archives")
+    parser.add_argument("-o", "--output-dir", help="write the output here instead of next to each source")
+    parser.add_argument("-f", "--format", choices=sorted(OUTPUT_FORMATS), default='json',
+                        help="json file, or a directory with one parquet/arrow table per message type")
+    parser.add_argument("-j", "--jobs", type=int, help="number of worker processes (default: CPU count)")
+    parser.add_argument("--manifest", default=MANIFEST_NAME, help="file recording the hashes already converted")
+    parser.add_argument("--force", action="store_true", help="convert files even if they were converted before")
+    parser.add_argument("--stream", action="store_true",
+                        help="write while decoding in constant memory (json becomes JSON lines, "
+                             "heart rates are not merged into the records)")
+    parser.add_argument("--keep", action="append", metavar="MESGS_KEY[:FIELD,...]",
+                        help="with --stream, only write these message types (and fields), e.g. "
+                             "record_mesgs:timestamp,heart_rate; can be repeated")
+    parser.add_argument("--store", metavar="STORE_DIR", help="also add each activity to this local activity store")
+    args = parser.parse_args()
+    if args.keep and not args.stream:
+        parser.error("--keep requires --stream")
+    if args.store and args.stream:
+        parser.error("--store needs whole activities, it cannot be combined with --stream")
+
+    converted, skipped, failed = convert_fit_files(args.paths, args.output_dir, args.manifest, args.jobs, args.force,
+                                                  args.format, args.stream, parse_keep(args.keep), args.store)
+    if failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,215 @@
+"""Loads FIT files straight into MongoDB (and optionally Postgres).
+
+    python ingest.py EXPORT_DIR_OR_FILES... [-j JOBS] [--postgres] [--force]
+
+Activities are upserted by device serial number and start time (see
+rollup.activity_key), with every timestamp stored as a native datetime.
+Files whose contents were ingested before are skipped without decoding them,
+so re-running on the same export folder only loads what is new.
+"""
+import io
+import sys
+import time
+import hashlib
+import argparse
+
+import pandas as pd
+from pymongo import ReplaceOne
+
+import fit_json
+import rollup
+
+# Activities decoded before they are written in one bulk request
+BATCH_SIZE = 20
+# Summary fields mirrored to Postgres, in column order ('_id' becomes 'id')
+PG_SUMMARY_TABLE = "fitness.activity_summaries"
+PG_SUMMARY_COLUMNS = {
+    'id': 'text PRIMARY KEY',
+    'start_time': 'timestamptz',
+    'sport': 'text',
+    'sub_sport': 'text',
+    'distance_km': 'double precision',
+    'elapsed_time': 'double precision',
+    'total_calories': 'double precision',
+    'avg_cadence': 'double precision',
+    'avg_temperature': 'double precision',
+    'total_ascent': 'double precision',
+    'total_descent': 'double precision',
+    'avg_pace': 'double precision',
+    'record_count': 'integer',
+    'records_avg_power': 'double precision',
+    'records_avg_cadence': 'double precision',
+    'records_avg_speed': 'double precision',
+}
+
+#########################################################################
+# Documents
+def bson_value(value):
+    # BSON documents only have string keys (developer fields are keyed by number)
+    if isinstance(value, dict):
+        return {str(key): bson_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [bson_value(item) for item in value]
+    return value
+
+
+def activity_document(messages, digest):
+    """The garmin_connect document of a decoded activity.
+
+    Datetimes are left as they come out of the decoder (UTC), so they are
+    stored as BSON dates instead of text.
+    """
+    session = messages['session_mesgs'][0]
+    document = {'_id': rollup.activity_key(messages), 'source_sha256': digest,
+                # Indexed copy of the session start, the activity's lookup key
+                'start_time': rollup.utc_datetime(session['start_time'])}
+    for mesgs_key, mesgs in messages.items():
+        document[mesgs_key] = bson_value(mesgs)
+    return document
+
+#########################################################################
+# Writers
+def device_serial(document):
+    return (document.get('file_id_mesgs') or [{}])[0].get('serial_number')
+
+
+def existing_ids(activities, documents):
+    """Maps (serial number, UTC start time) of `documents` to the `_id` already stored for them.
+
+    Activities uploaded before ingest.py have ObjectId ids instead of the
+    activity key, so they are matched on the device and the indexed start time
+    (run migrate_dates.py on them first).
+    """
+    keys = [(device_serial(document), document['start_time']) for document in documents]
+    if not keys:
+        return {}
+    query = {'$or': [{'file_id_mesgs.serial_number': serial, 'start_time': start_time} for serial, start_time in keys]}
+    projection = {'file_id_mesgs.serial_number': 1, 'start_time': 1}
+    return {(device_serial(stored), rollup.utc_datetime(stored['start_time'])): stored['_id']
+            for stored in activities.find(query, projection)}
+
+
+def write_activities(activities, summaries, documents):
+    """Upserts the documents and their summaries, returns the summaries."""
+    # The same activity is replaced under its stored id, whatever that id is
+    stored_ids = existing_ids(activities, documents)
+    for document in documents:
+        document['_id'] = stored_ids.get((device_serial(document), document['start_time']), document['_id'])
+    requests = [ReplaceOne({'_id': document['_id']}, document, upsert=True) for document in documents]
+    if requests:
+        activities.bulk_write(requests, ordered=False)
+    activity_summaries = [rollup.summarize_activity(document) for document in documents]
+    rollup.upsert_summaries(summaries, activity_summaries)
+    return activity_summaries
+
+
+def mirror_summaries(conn, summaries):
+    """Upserts `summaries` into PG_SUMMARY_TABLE through one COPY."""
+    if not summaries:
+        return 0
+    frame = pd.DataFrame(summaries).rename(columns={'_id': 'id'}).reindex(columns=list(PG_SUMMARY_COLUMNS))
+    buffer = io.StringIO()
+    frame.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+
+    columns = ", ".join(PG_SUMMARY_COLUMNS)
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in PG_SUMMARY_COLUMNS if column != 'id')
+    definition = ", ".join(f"{column} {column_type}" for column, column_type in PG_SUMMARY_COLUMNS.items())
+    with conn.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {PG_SUMMARY_TABLE} ({definition});")
+        # COPY cannot upsert, so rows land in a temporary table first
+        cursor.execute(f"CREATE TEMP TABLE summaries_load (LIKE {PG_SUMMARY_TABLE}) ON COMMIT DROP;")
+        cursor.copy_expert(f"COPY summaries_load ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(f"INSERT INTO {PG_SUMMARY_TABLE} ({columns}) SELECT {columns} FROM summaries_load "
+                       f"ON CONFLICT (id) DO UPDATE SET {updates};")
+    conn.commit()
+    return len(frame)
+
+#########################################################################
+# Decoding (runs in the fit_json.process_sources workers)
+def _decode_source(source, known_hashes):
+    path, member, _ = source
+    fit_bytes = fit_json.read_source(path, member)
+    digest = hashlib.sha256(fit_bytes).hexdigest()
+    result = {'source': source, 'bytes': len(fit_bytes), 'document': None, 'errors': None,
+              'skipped': digest in known_hashes}
+    if result['skipped']:
+        return result
+
+    messages, errors = fit_json.decode_fit(fit_bytes)
+    if errors:
+        result['errors'] = [str(error) for error in errors]
+    elif not messages.get('session_mesgs'):
+        result['errors'] = ["no session message"]
+    else:
+        result['document'] = activity_document(messages, digest)
+    return result
+
+
+def ingest_fit_files(paths, activities, summaries, pg_conn=None, jobs=None, batch_size=BATCH_SIZE, force=False):
+    """Decodes every FIT file found in `paths` and upserts it into the collections.
+
+    `activities` and `summaries` are the garmin_connect and garmin_summaries
+    collections. With `pg_conn`, the summaries are mirrored to Postgres too.
+    """
+    sources = fit_json.find_fit_sources(paths)
+    known_hashes = set() if force else set(activities.distinct('source_sha256'))
+
+    started = time.perf_counter()
+    ingested = skipped = failed = 0
+    batch = []
+
+    def flush():
+        nonlocal ingested
+        activity_summaries = write_activities(activities, summaries, batch)
+        if pg_conn is not None:
+            mirror_summaries(pg_conn, activity_summaries)
+        ingested += len(activity_summaries)
+        batch.clear()
+
+    # Decoded activities wait in memory, so only a few files are in flight
+    for result in fit_json.process_sources(_decode_source, sources, jobs, known_hashes=known_hashes):
+        path, member, _ = result['source']
+        name = f"{path}:{member}" if member else path
+        if result['skipped']:
+            skipped += 1
+        elif result['errors']:
+            failed += 1
+            print(f"Errors encountered in {name}:", result['errors'])
+        else:
+            batch.append(result['document'])
+            if len(batch) >= batch_size:
+                flush()
+    flush()
+
+    elapsed = time.perf_counter() - started
+    print(f"{ingested} ingested, {skipped} already ingested, {failed} failed in {elapsed:.2f}s")
+    return ingested, skipped, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load Garmin .fit files into MongoDB.")
+    parser.add_argument("paths", nargs="+", help=".fit files, directories, glob patterns or .zip archives")
+    parser.add_argument("-j", "--jobs", type=int, help="number of decoding processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="activities per bulk write")
+    parser.add_argument("--postgres", action="store_true", help=f"also mirror the summaries to {PG_SUMMARY_TABLE}")
+    parser.add_argument("--force", action="store_true", help="ingest files even if they were ingested before")
+    args = parser.parse_args()
+
+    import data
+
+    data.create_activity_indexes()
+    pg_pool = data.get_pg_pool() if args.postgres else None
+    pg_conn = pg_pool.getconn() if pg_pool else None
+    try:
+        _, _, failed = ingest_fit_files(args.paths, data.get_garmin_collection(), data.get_summary_collection(),
+                                        pg_conn, args.jobs, args.batch_size, args.force)
+    finally:
+        if pg_conn is not None:
+            pg_pool.putconn(pg_conn)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import threading
+import cProfile
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+
+# FIT_APP_DEBUG=1 (or ?debug=1 in the URL) shows the stage timings in the sidebar
+DEBUG = os.environ.get("FIT_APP_DEBUG", "") not in ("", "0")
+# Every rerun's timings are appended to this JSON lines file when it is set
+TIMINGS_LOG = os.environ.get("FIT_APP_TIMINGS_LOG")
+# FIT_APP_PROFILE=cprofile or pyinstrument dumps a profile of every rerun here
+PROFILE = os.environ.get("FIT_APP_PROFILE")
+PROFILE_DIR = os.environ.get("FIT_APP_PROFILE_DIR", "profiles")
+
+# Each Streamlit session reruns the script in its own thread
+_local = threading.local()
+
+
+class Rerun:
+    """Timings and counters collected during one run of the script."""
+
+    def __init__(self):
+        self.started = self.last_lap = time.perf_counter()
+        self.spans = []
+        self.counters = {}
+        self.profiler = None
+        self.debug = DEBUG
+
+
+def current():
+    if not hasattr(_local, "rerun"):
+        _local.rerun = Rerun()
+    return _local.rerun
+
+
+def debug_enabled():
+    return current().debug
+
+
+def start():
+    """Starts collecting for a new rerun (call once the page is shown)."""
+    # A rerun cut short by st.rerun() or an exception never reached finish(),
+    # so its profiler is still running on this thread
+    previous = getattr(_local, "rerun", None)
+    if previous is not None and previous.profiler is not None:
+        _dump_profile(previous)
+    rerun = _local.rerun = Rerun()
+    rerun.debug = DEBUG or st.experimental_get_query_params().get("debug", ["0"])[0] not in ("", "0")
+    if PROFILE == "cprofile":
+        rerun.profiler = cProfile.Profile()
+        rerun.profiler.enable()
+    elif PROFILE == "pyinstrument":
+        # Optional, only needed for this profiling mode
+        from pyinstrument import Profiler
+        rerun.profiler = Profiler()
+        rerun.profiler.start()
+
+
+@contextmanager
+def span(name):
+    """Times the enclosed stage under `name`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        current().spans.append((name, time.perf_counter() - started))
+
+
+def lap(name):
+    """Times everything since the previous lap (or the start) under `name`."""
+    rerun = current()
+    now = time.perf_counter()
+    rerun.spans.append((name, now - rerun.last_lap))
+    rerun.last_lap = now
+
+
+def count(name, value=1):
+    """Adds `value` to the counter `name` (rows fetched, payload bytes, ...)."""
+    counters = current().counters
+    counters[name] = counters.get(name, 0) + value
+
+
+def count_figure(name, fig):
+    # Serializing a figure is not free, so its size is only measured when debugging
+    if debug_enabled():
+        count(f"{name} JSON bytes", len(fig.to_json()))
+
+
+def _dump_profile(rerun):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    if PROFILE == "cprofile":
+        rerun.profiler.disable()
+        rerun.profiler.dump_stats(os.path.join(PROFILE_DIR, f"rerun-{stamp}.prof"))
+    else:
+        rerun.profiler.stop()
+        with open(os.path.join(PROFILE_DIR, f"rerun-{stamp}.html"), "w") as html_file:
+            html_file.write(rerun.profiler.output_html())
+    rerun.profiler = None
+
+
+def finish():
+    """Ends the rerun: dumps the profile, logs the timings and shows the debug panel."""
+    rerun = current()
+    total = time.perf_counter() - rerun.started
+    if rerun.profiler is not None:
+        _dump_profile(rerun)
+
+    if TIMINGS_LOG:
+        entry = {
+            "time": datetime.now().isoformat(),
+            "total": total,
+            "spans": [{"name": name, "seconds": seconds} for name, seconds in rerun.spans],
+            "counters": rerun.counters,
+        }
+        with open(TIMINGS_LOG, "a") as log_file:
+            log_file.write(json.dumps(entry) + "\n")
+
+    if rerun.debug:
+        with st.sidebar:
+            st.markdown("### Rerun timings")
+            st.write(f"Total: {total * 1000:.1f} ms")
+            timings = pd.DataFrame(rerun.spans, columns=["stage", "seconds"])
+            timings = timings.groupby("stage", sort=False)["seconds"].agg(ms="sum", calls="count")
+            timings["ms"] *= 1000
+            st.dataframe(timings, use_container_width=True)
+            st.markdown("### Counters")
+            st.json(rerun.counters)
@@ -0,0 +1,79 @@
+"""Converts the text times stored by fit_json.py uploads into native dates.
+
+    python migrate_dates.py [--batch-size N]
+
+Every `YYYY-MM-DD HH:MM:SS+00:00` string in garmin_connect messages becomes a
+UTC date, each activity gets an indexed top-level `start_time`, and every
+summary's start time becomes a date with a matching `end_time`. Documents
+that were already migrated are left alone, so the tool can be re-run.
+"""
+import re
+import argparse
+from datetime import timedelta
+
+from pymongo import UpdateOne
+
+import rollup
+
+# How json.dump(..., default=str) writes the decoder's UTC datetimes
+TEXT_TIME = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(\.\d+)?\+00:00$")
+BATCH_SIZE = 20
+
+
+def convert_times(value):
+    """Returns `value` with every text time inside it converted to a datetime."""
+    if isinstance(value, str) and TEXT_TIME.match(value):
+        return rollup.utc_datetime(value)
+    if isinstance(value, dict):
+        return {key: convert_times(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [convert_times(item) for item in value]
+    return value
+
+
+def migrate_activities(collection, batch_size=BATCH_SIZE):
+    """Converts the activities without a top-level date `start_time`."""
+    updates = []
+    count = 0
+    query = {"start_time": {"$not": {"$type": "date"}}, "session_mesgs.0": {"$exists": True}}
+    for document in collection.find(query, batch_size=batch_size):
+        changes = {key: convert_times(mesgs) for key, mesgs in document.items() if key.endswith("_mesgs")}
+        changes['start_time'] = rollup.utc_datetime(changes['session_mesgs'][0]['start_time'])
+        updates.append(UpdateOne({'_id': document['_id']}, {'$set': changes}))
+        if len(updates) >= batch_size:
+            count += collection.bulk_write(updates, ordered=False).modified_count
+            updates = []
+    if updates:
+        count += collection.bulk_write(updates, ordered=False).modified_count
+    return count
+
+
+def migrate_summaries(collection, batch_size=BATCH_SIZE):
+    """Converts the summaries whose `start_time` is still text."""
+    updates = []
+    projection = {'start_time': 1, 'elapsed_time': 1}
+    for summary in collection.find({"start_time": {"$type": "string"}}, projection, batch_size=batch_size):
+        start_time = rollup.utc_datetime(summary['start_time'])
+        end_time = start_time + timedelta(seconds=summary.get('elapsed_time') or 0)
+        updates.append(UpdateOne({'_id': summary['_id']}, {'$set': {'start_time': start_time, 'end_time': end_time}}))
+    # Summaries are small, so they go in one request
+    if updates:
+        collection.bulk_write(updates, ordered=False)
+    return len(updates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Store activity times as native UTC dates.")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="activities converted per bulk write")
+    args = parser.parse_args()
+
+    import data
+
+    activities = migrate_activities(data.get_garmin_collection(), args.batch_size)
+    summaries = migrate_summaries(data.get_summary_collection(), args.batch_size)
+    data.create_activity_indexes()
+    print(f"{activities} activities and {summaries} summaries migrated.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+
+# Seconds between aligned samples
+INTERVAL = 1
+# Holes up to this long (seconds) are interpolated, longer ones are gaps (auto pause, dropouts)
+MAX_GAP = 10
+# Below this speed (m/s) the athlete is stopped
+MIN_MOVING_SPEED = 0.3
+# Rolling-median (Hampel) filter: window in samples and deviations in MADs
+OUTLIER_WINDOW = 9
+OUTLIER_SIGMAS = 4
+# Fields checked for spikes and the smallest deviation counted as one, in their units.
+# Only sensor glitches (GPS speed jumps, barometer steps) are masked: power, cadence and
+# heart rate are left alone, since a short sprint looks just like a spike to the filter.
+OUTLIER_TOLERANCE = {
+    'enhanced_speed': 2.0,
+    'speed': 2.0,
+    'enhanced_altitude': 20,
+}
+# Zeros in these fields are stops, not spikes
+ZERO_IS_STOP = {'enhanced_speed', 'speed'}
+# Columns kept as float64 (cumulative or semicircle values), the rest are float32
+DOUBLE_COLUMNS = {'distance', 'position_lat', 'position_long'}
+
+#########################################################################
+# Building blocks
+def flag_outliers(values, tolerance, window=OUTLIER_WINDOW, sigmas=OUTLIER_SIGMAS):
+    """Marks single samples further than `sigmas` MADs (and `tolerance`) from their rolling median.
+
+    Runs of two or more such samples are kept, they are more likely real changes than glitches.
+    """
+    series = pd.Series(values, dtype=float)
+    median = series.rolling(window, center=True, min_periods=1).median()
+    deviation = (series - median).abs()
+    # 1.4826 scales the MAD to a standard deviation for normal noise
+    mad = deviation.rolling(window, center=True, min_periods=1).median() * 1.4826
+    flagged = (deviation > np.maximum(sigmas * mad, tolerance)).to_numpy()
+    neighbours = np.zeros_like(flagged)
+    neighbours[1:] |= flagged[:-1]
+    neighbours[:-1] |= flagged[1:]
+    return flagged & ~neighbours
+
+
+def sample_grid(seconds, interval=INTERVAL, max_gap=MAX_GAP):
+    """Regular times over each recorded stretch, and which of them mark a gap.
+
+    Stretches are split where records are more than `max_gap` apart. A gap is
+    a single row right after its stretch, so charts break the line there
+    without a row for every paused second.
+    """
+    breaks = np.flatnonzero(np.diff(seconds) > max_gap)
+    starts = np.concatenate([seconds[:1], seconds[breaks + 1]])
+    ends = np.concatenate([seconds[breaks], seconds[-1:]])
+    lengths = (ends - starts) // interval + 1
+    # Every stretch but the last gets its gap row
+    lengths[:-1] += 1
+    firsts = np.cumsum(lengths) - lengths
+    steps = np.arange(lengths.sum()) - np.repeat(firsts, lengths)
+    grid = np.repeat(starts, lengths) + steps * interval
+    gap = np.zeros(len(grid), dtype=bool)
+    gap[firsts[1:] - 1] = True
+    return grid, gap
+
+
+def align(seconds, values, grid, max_gap=MAX_GAP):
+    """`values` linearly interpolated onto `grid`, NaN wherever its own samples are over `max_gap` apart."""
+    present = ~np.isnan(values)
+    seconds, values = seconds[present], values[present]
+    if len(seconds) == 0:
+        return np.full(len(grid), np.nan)
+    aligned = np.interp(grid, seconds, values, left=np.nan, right=np.nan)
+    # Samples on either side of every grid time
+    before = np.clip(np.searchsorted(seconds, grid, side='right') - 1, 0, len(seconds) - 1)
+    after = np.minimum(before + 1, len(seconds) - 1)
+    exact = seconds[before] == grid
+    aligned[~exact & (seconds[after] - seconds[before] > max_gap)] = np.nan
+    return aligned
+
+#########################################################################
+def resample_records(records, interval=INTERVAL, max_gap=MAX_GAP):
+    """Cleans an activity's records DataFrame and aligns it to `interval` seconds.
+
+    `records` has UTC epoch second timestamps (see activity.load_records).
+    Sensor spikes are masked, then every numeric column is interpolated onto the
+    grid across holes up to `max_gap` and left NaN across longer ones. Returns
+    the samples, with `gap` and `paused` flags, and a data quality summary.
+    """
+    if records.empty or 'timestamp' not in records:
+        return pd.DataFrame({'timestamp': np.array([], dtype='int64')}), {}
+
+    records = records.sort_values('timestamp', kind='stable')
+    seconds = records['timestamp'].to_numpy(dtype='int64')
+    # Keep the last of records sharing a timestamp
+    unique = np.append(seconds[1:] != seconds[:-1], True)
+    records, seconds = records[unique], seconds[unique]
+
+    grid, gap = sample_grid(seconds, interval, max_gap)
+    samples = {'timestamp': grid}
+    outliers = {}
+    columns = records.drop(columns='timestamp').select_dtypes(['number', 'bool']).columns
+    for column in columns:
+        values = records[column].to_numpy(dtype=float)
+        if column in OUTLIER_TOLERANCE:
+            flagged = flag_outliers(values, OUTLIER_TOLERANCE[column])
+            if column in ZERO_IS_STOP:
+                flagged &= values != 0
+            values = np.where(flagged, np.nan, values)
+            outliers[column] = int(flagged.sum())
+        aligned = align(seconds, values, grid, max_gap)
+        aligned[gap] = np.nan
+        samples[column] = aligned if column in DOUBLE_COLUMNS else aligned.astype(np.float32)
+
+    samples = pd.DataFrame(samples)
+    samples['gap'] = gap
+    speed_column = next((column for column in ('enhanced_speed', 'speed') if column in samples), None)
+    samples['paused'] = gap.copy()
+    if speed_column:
+        samples['paused'] |= (samples[speed_column] < MIN_MOVING_SPEED).to_numpy()
+
+    breaks = np.diff(seconds)
+    quality = {
+        'interval': interval,
+        'gaps': int(gap.sum()),
+        'gap_seconds': int(breaks[breaks > max_gap].sum()),
+        'moving_time': int((~samples['paused']).sum() * interval),
+        'outliers': outliers,
+    }
+    return samples, quality
@@ -0,0 +1,103 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# Output column -> (input column, time window, statistic, minimum observations)
+WEIGHT_WINDOWS = {
+    'median_10d_lbs': ('lbs', '10D', 'median', 3),
+    'avg_10d_caloric_intake': ('caloric_intake', '10D', 'mean', 3),
+    'avg_7d_cardio_calories': ('cardio_calories', '7D', 'mean', 3),
+    'std_10d_lbs': ('lbs', '10D', 'std', 1),
+}
+
+#########################################################################
+def window_starts(dates, window):
+    """Index of the first row inside the `window` ending at each row, like pandas' '10D'."""
+    return np.searchsorted(dates, dates - pd.Timedelta(window).to_timedelta64(), side='right')
+
+
+def windowed_statistic(values, starts, statistic, min_periods, first_row):
+    """Evaluates `statistic` over the window of every row from `first_row` on."""
+    # Only the part of the input that the recomputed windows can reach is used
+    offset = starts[first_row] if first_row < len(values) else len(values)
+    values = values[offset:]
+    starts = starts[first_row:] - offset
+    ends = np.arange(first_row, first_row + len(starts)) + 1 - offset
+
+    present = ~np.isnan(values)
+    counts = np.concatenate([[0], np.cumsum(present)])
+    count = counts[ends] - counts[starts]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if statistic == 'median':
+            result = np.array([np.nanmedian(values[start:end]) if end > start and present[start:end].any()
+                               else np.nan for start, end in zip(starts, ends)])
+        else:
+            # Sums are taken around the mean to keep the variance numerically stable
+            center = np.nanmean(values) if present.any() else 0.0
+            shifted = np.where(present, values - center, 0)
+            sums = np.concatenate([[0], np.cumsum(shifted)])
+            window_sum = sums[ends] - sums[starts]
+            if statistic == 'mean':
+                result = window_sum / count + center
+            elif statistic == 'std':
+                squares = np.concatenate([[0], np.cumsum(shifted ** 2)])
+                window_squares = squares[ends] - squares[starts]
+                variance = (window_squares - window_sum ** 2 / count) / (count - 1)
+                result = np.sqrt(np.clip(variance, 0, None))
+            else:
+                raise ValueError(f"Unknown statistic '{statistic}'")
+    result[count < max(min_periods, 2 if statistic == 'std' else 1)] = np.nan
+    return result
+
+
+class RollingStats:
+    """Time-windowed statistics of a dated frame, computed in one pass.
+
+    The last inputs and results are kept, so when days are appended (or the
+    most recent day changes) only the rows whose windows changed are redone.
+    """
+
+    def __init__(self, windows):
+        self.windows = windows
+        self.columns = sorted({column for column, _, _, _ in windows.values()})
+        self.inputs = None
+        self.results = None
+        self.lock = threading.Lock()
+
+    def first_changed_row(self, inputs):
+        if self.inputs is None:
+            return 0
+        common = min(len(self.inputs), len(inputs))
+        old, new = self.inputs.iloc[:common], inputs.iloc[:common]
+        same = (old.index == new.index) & ((old.to_numpy() == new.to_numpy())
+                                           | (old.isna().to_numpy() & new.isna().to_numpy())).all(axis=1)
+        changed = np.flatnonzero(~same)
+        return int(changed[0]) if len(changed) else common
+
+    def update(self, frame, date_column='date'):
+        """Returns the statistics of `frame` (sorted by date), one row per input row."""
+        dates = pd.to_datetime(frame[date_column]).to_numpy(dtype='datetime64[ns]')
+        inputs = pd.DataFrame(frame[self.columns].to_numpy(dtype=float), index=dates, columns=self.columns)
+        with self.lock:
+            first_row = self.first_changed_row(inputs)
+            # Windows only look back, so the rows before the first change are kept
+            if first_row < len(inputs):
+                tail = {}
+                for output, (column, window, statistic, min_periods) in self.windows.items():
+                    starts = window_starts(dates, window)
+                    tail[output] = windowed_statistic(inputs[column].to_numpy(), starts, statistic,
+                                                      min_periods, first_row)
+                tail = pd.DataFrame(tail, columns=list(self.windows))
+                head = self.results.iloc[:first_row] if self.results is not None else tail.iloc[:0]
+                self.results = pd.concat([head, tail], ignore_index=True)
+            else:
+                self.results = self.results.iloc[:len(inputs)]
+            self.inputs = inputs
+            return self.results.copy()
+
+
+@st.cache_resource
+def weight_stats():
+    return RollingStats(WEIGHT_WINDOWS)
@@ -0,0 +1,152 @@
+import sys
+import json
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+from pymongo import ReplaceOne
+
+import activity
+import analytics
+import resample
+import thumbnails
+
+# Record fields summarized with max and percentiles
+STAT_FIELDS = ['enhanced_speed', 'heart_rate', 'cadence', 'power', 'enhanced_altitude']
+# Zeros in these fields are stops, not samples
+ZERO_IS_MISSING = {'enhanced_speed', 'cadence', 'power'}
+PERCENTILES = [50, 90, 95]
+
+def utc_datetime(value):
+    """Returns a FIT time (datetime, or text as fit_json.py writes it) as an aware UTC datetime."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        # MongoDB hands back dates as naive UTC
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def activity_key(messages):
+    """Returns the id of an activity: device serial number and session start time."""
+    file_id = (messages.get('file_id_mesgs') or [{}])[0]
+    session = messages['session_mesgs'][0]
+    # Formatted like the text times, so keys don't change when times are stored as dates
+    return f"{file_id.get('serial_number', 'unknown')}_{utc_datetime(session['start_time'])}"
+
+def record_stats(records):
+    stats = {}
+    for field in STAT_FIELDS:
+        if field not in records:
+            continue
+        values = records[field].to_numpy(dtype=float)
+        if field in ZERO_IS_MISSING:
+            values = values[values != 0]
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            continue
+        stats[field] = {'max': float(values.max())}
+        for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+            stats[field][f'p{percentile}'] = float(value)
+    return stats
+
+def lap_splits(lap_mesgs):
+    splits = []
+    for lap in lap_mesgs:
+        distance = lap.get('total_distance') or 0
+        elapsed_time = lap.get('total_elapsed_time') or 0
+        split = {
+            'distance_km': distance / 1000,
+            'elapsed_time': elapsed_time,
+            'avg_heart_rate': lap.get('avg_heart_rate'),
+            'avg_power': lap.get('avg_power'),
+        }
+        # Pace in min/km
+        split['pace'] = elapsed_time / 60 / (distance / 1000) if distance else None
+        splits.append(split)
+    return splits
+
+def summarize_activity(messages):
+    """Builds the compact summary the dashboard lists instead of the full activity."""
+    session = messages['session_mesgs'][0]
+    record_mesgs = messages.get('record_mesgs', [])
+    # Stats and averages come from the cleaned, regularly sampled records
+    records, quality = resample.resample_records(activity.load_records(record_mesgs) if record_mesgs
+                                                 else pd.DataFrame())
+    start_time = utc_datetime(session['start_time'])
+
+    summary = {
+        '_id': activity_key(messages),
+        # Stored as dates, so start_time range queries compare times rather than text
+        'start_time': start_time,
+        'end_time': start_time + timedelta(seconds=session.get('total_elapsed_time') or 0),
+        'sport': session.get('sport'),
+        'sub_sport': session.get('sub_sport'),
+        'distance_km': (session.get('total_distance') or 0) / 1000,
+        'elapsed_time': session.get('total_elapsed_time'),
+        'total_calories': session.get('total_calories'),
+        'avg_cadence': session.get('avg_cadence'),
+        'avg_temperature': session.get('avg_temperature'),
+        'total_ascent': session.get('total_ascent'),
+        'total_descent': session.get('total_descent'),
+        'record_count': len(record_mesgs),
+        'laps': lap_splits(messages.get('lap_mesgs', [])),
+        'stats': record_stats(records),
+        # Kept per activity so the best-effort envelopes are a cheap merge (see analytics.py)
+        'best_efforts': analytics.best_efforts(records),
+        'data_quality': quality,
+    }
+
+    # Convert m/s to min/km
+    avg_speed = session.get('enhanced_avg_speed')
+    summary['avg_pace'] = 1000 / avg_speed / 60 if avg_speed else None
+
+    # Drawn once here, so activity lists show the route without building a map
+    if {'position_lat', 'position_long'} <= set(records.columns):
+        route_lat, route_long = activity.route_degrees(records)
+        if len(route_lat) > 1:
+            summary['route_svg'] = thumbnails.route_svg(route_lat, route_long)
+
+    # Indoor rides are summarized from their records, zeros included and weighted by time
+    speed_field = 'speed' if 'speed' in records else 'enhanced_speed'
+    for name, field in [('power', 'power'), ('cadence', 'cadence'), ('speed', speed_field)]:
+        if field in records:
+            summary[f'records_avg_{name}'] = float(records[field].mean())
+    return summary
+
+def upsert_summaries(collection, summaries):
+    """Replaces (or inserts) each summary by its activity key."""
+    requests = [ReplaceOne({'_id': summary['_id']}, summary, upsert=True) for summary in summaries]
+    if requests:
+        collection.bulk_write(requests, ordered=False)
+    return len(requests)
+
+def summarize_file(json_path):
+    with open(json_path) as json_file:
+        return summarize_activity(json.load(json_file))
+
+def backfill(source, target, batch_size=50):
+    """Summarizes every activity already stored in `source` into `target`."""
+    summaries = []
+    count = 0
+    for document in source.find({}, batch_size=batch_size):
+        if not document.get('session_mesgs'):
+            continue
+        summaries.append(summarize_activity(document))
+        if len(summaries) >= batch_size:
+            count += upsert_summaries(target, summaries)
+            summaries = []
+    return count + upsert_summaries(target, summaries)
+
+def main():
+    import data
+
+    target = data.get_summary_collection()
+    if len(sys.argv) < 2:
+        # No files given, summarize what is already in garmin_connect
+        count = backfill(data.get_garmin_collection(), target)
+    else:
+        count = upsert_summaries(target, [summarize_file(json_path) for json_path in sys.argv[1:]])
+    print(f"{count} activity summaries saved.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""Local activity store, so the dashboard can run without MongoDB.
+
+    python store.py add FIT_FILES_DIRS_OR_ZIPS...   (or fit_json.py --store)
+    python store.py sync                            (copy what is in MongoDB)
+    python store.py evict [--max-age-days N] [--max-mb N]
+    python store.py compact
+
+Each activity's records are an uncompressed Arrow IPC file, read through a
+memory map, and a SQLite index holds the summaries (see rollup.py) by start
+time. The dashboard reads from it when FIT_APP_OFFLINE=1.
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import argparse
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.feather as feather
+
+import activity
+import rollup
+
+STORE_DIR = os.environ.get("FIT_APP_STORE", "activity_store")
+INDEX_NAME = "index.sqlite"
+RECORDS_DIR = "records"
+# Record columns kept in the store and their Arrow types (timestamps are UTC epoch seconds)
+RECORD_TYPES = {
+    'timestamp': pa.int64(),
+    'enhanced_speed': pa.float32(),
+    'enhanced_altitude': pa.float32(),
+    'speed': pa.float32(),
+    'cadence': pa.float32(),
+    'power': pa.float32(),
+    'heart_rate': pa.float32(),
+    'distance': pa.float64(),
+    'position_lat': pa.int32(),
+    'position_long': pa.int32(),
+}
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS activities (
+    id TEXT PRIMARY KEY,
+    start_time INTEGER NOT NULL,
+    end_time INTEGER NOT NULL,
+    sport TEXT,
+    sub_sport TEXT,
+    summary TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    added_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS activities_start_time ON activities (start_time, sport);
+"""
+
+#########################################################################
+def connect(store_dir=STORE_DIR):
+    """Opens the store's index, creating the store if needed."""
+    os.makedirs(os.path.join(store_dir, RECORDS_DIR), exist_ok=True)
+    # Conversion workers may add activities at the same time
+    conn = sqlite3.connect(os.path.join(store_dir, INDEX_NAME), timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def epoch(value):
+    return int(rollup.utc_datetime(value).timestamp())
+
+
+def utc_naive(seconds):
+    # The same naive UTC datetimes MongoDB hands back
+    return datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None)
+
+
+def records_table(record_mesgs):
+    """Arrow table of the stored record columns, with timestamps as UTC epoch seconds."""
+    columns = {}
+    for name, value_type in RECORD_TYPES.items():
+        values = [mesg.get(name) for mesg in record_mesgs]
+        if all(value is None for value in values):
+            continue
+        if name == 'timestamp':
+            values = activity.epoch_seconds(values)
+        columns[name] = pa.array(values, type=value_type, from_pandas=True)
+    return pa.table(columns)
+
+#########################################################################
+# Writing
+def add_activity(messages, store_dir=STORE_DIR, conn=None):
+    """Adds (or replaces) a decoded activity, returns its id."""
+    summary = rollup.summarize_activity(messages)
+    file_name = re.sub(r"[^0-9A-Za-z_-]+", "-", summary['_id']) + ".arrow"
+    path = os.path.join(store_dir, RECORDS_DIR, file_name)
+
+    own_conn = conn is None
+    conn = conn or connect(store_dir)
+    try:
+        # Written aside and renamed, so readers never map a half-written file
+        temporary_path = path + ".tmp"
+        feather.write_feather(records_table(messages.get('record_mesgs', [])), temporary_path,
+                              compression='uncompressed')
+        os.replace(temporary_path, path)
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO activities VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);", (
+                summary['_id'], epoch(summary['start_time']), epoch(summary['end_time']),
+                summary['sport'], summary['sub_sport'], json.dumps(summary, default=str),
+                file_name, os.path.getsize(path), int(time.time())))
+    finally:
+        if own_conn:
+            conn.close()
+    return summary['_id']
+
+#########################################################################
+# Reading
+def _summary(row):
+    start_time, end_time, summary = row
+    summary = json.loads(summary)
+    summary['start_time'] = utc_naive(start_time)
+    summary['end_time'] = utc_naive(end_time)
+    return summary
+
+
+def load_summaries(start_utc, end_utc, sport_filter, store_dir=STORE_DIR):
+    """Summaries starting in the UTC range that match one of the `sport_filter` entries."""
+    sports = " OR ".join("(" + " AND ".join(f"{field} = ?" for field in entry) + ")" for entry in sport_filter)
+    params = [epoch(start_utc), epoch(end_utc)] + [value for entry in sport_filter for value in entry.values()]
+    conn = connect(store_dir)
+    try:
+        rows = conn.execute("SELECT start_time, end_time, summary FROM activities "
+                            f"WHERE start_time >= ? AND start_time < ? AND ({sports}) ORDER BY start_time;",
+                            params).fetchall()
+    finally:
+        conn.close()
+    return [_summary(row) for row in rows]
+
+
+def load_best_efforts(store_dir=STORE_DIR):
+    conn = connect(store_dir)
+    try:
+        rows = conn.execute("SELECT start_time, end_time, summary FROM activities ORDER BY start_time;").fetchall()
+    finally:
+        conn.close()
+    return [summary for summary in map(_summary, rows) if 'best_efforts' in summary]
+
+
+def records_path(start_time, store_dir=STORE_DIR):
+    conn = connect(store_dir)
+    try:
+        row = conn.execute("SELECT file_name FROM activities WHERE start_time = ?;", (epoch(start_time),)).fetchone()
+    finally:
+        conn.close()
+    return os.path.join(store_dir, RECORDS_DIR, row[0]) if row else None
+
+
+def load_records(start_time, store_dir=STORE_DIR):
+    """Records DataFrame of the activity starting at `start_time`, like activity.load_records.
+
+    The columns are memory-mapped, so columns without gaps are not copied.
+    """
+    path = records_path(start_time, store_dir)
+    if path is None:
+        return records_frame(pa.table({'timestamp': pa.array([], type=pa.int64())}))
+    return records_frame(feather.read_table(path, memory_map=True))
+
+
+def records_frame(table):
+    # split_blocks keeps every column in its own (mapped) buffer instead of consolidating them
+    return table.to_pandas(split_blocks=True)
+
+#########################################################################
+# Maintenance
+def evict(store_dir=STORE_DIR, max_age_days=None, max_bytes=None):
+    """Removes activities older than `max_age_days`, then the oldest until the store fits `max_bytes`."""
+    conn = connect(store_dir)
+    try:
+        rows = conn.execute("SELECT id, start_time, file_name, bytes FROM activities "
+                            "ORDER BY start_time DESC;").fetchall()
+        kept_bytes = 0
+        evicted = []
+        oldest_kept = time.time() - max_age_days * 86400 if max_age_days is not None else None
+        for activity_id, start_time, file_name, size in rows:
+            too_old = oldest_kept is not None and start_time < oldest_kept
+            too_big = max_bytes is not None and kept_bytes + size > max_bytes
+            if too_old or too_big:
+                evicted.append((activity_id, file_name))
+            else:
+                kept_bytes += size
+        with conn:
+            conn.executemany("DELETE FROM activities WHERE id = ?;", [(activity_id,) for activity_id, _ in evicted])
+        for _, file_name in evicted:
+            path = os.path.join(store_dir, RECORDS_DIR, file_name)
+            if os.path.exists(path):
+                os.remove(path)
+    finally:
+        conn.close()
+    return len(evicted)
+
+
+def compact(store_dir=STORE_DIR):
+    """Drops record files nobody indexes and index rows without a file, then vacuums the index."""
+    conn = connect(store_dir)
+    try:
+        indexed = dict(conn.execute("SELECT file_name, id FROM activities;").fetchall())
+        records_dir = os.path.join(store_dir, RECORDS_DIR)
+        on_disk = set(os.listdir(records_dir))
+        for file_name in on_disk - set(indexed):
+            os.remove(os.path.join(records_dir, file_name))
+        missing = [(indexed[file_name],) for file_name in set(indexed) - on_disk]
+        with conn:
+            conn.executemany("DELETE FROM activities WHERE id = ?;", missing)
+        conn.execute("VACUUM;")
+    finally:
+        conn.close()
+    return len(on_disk - set(indexed)), len(missing)
+
+
+def sync_from_mongo(collection, store_dir=STORE_DIR, batch_size=20):
+    """Copies the activities in `collection` (garmin_connect) that the store does not have yet."""
+    conn = connect(store_dir)
+    try:
+        stored = {utc_naive(start_time) for (start_time,) in conn.execute("SELECT start_time FROM activities;")}
+        count = 0
+        for document in collection.find({"start_time": {"$nin": list(stored)}}, batch_size=batch_size):
+            if document.get('session_mesgs'):
+                add_activity(document, store_dir, conn)
+                count += 1
+    finally:
+        conn.close()
+    return count
+
+
+def add_fit_files(paths, store_dir=STORE_DIR):
+    import fit_json
+
+    conn = connect(store_dir)
+    try:
+        count = 0
+        for path, member, _ in fit_json.find_fit_sources(paths):
+            messages, errors = fit_json.decode_fit(fit_json.read_source(path, member))
+            if errors or not messages.get('session_mesgs'):
+                print(f"Skipped {path}{':' + member if member else ''}:", errors or "no session message")
+                continue
+            add_activity(messages, store_dir, conn)
+            count += 1
+    finally:
+        conn.close()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the local activity store.")
+    parser.add_argument("--store", default=STORE_DIR, help="store directory (default: $FIT_APP_STORE or activity_store)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add_parser = commands.add_parser("add", help="decode FIT files into the store")
+    add_parser.add_argument("paths", nargs="+", help=".fit files, directories, glob patterns or .zip archives")
+    commands.add_parser("sync", help="copy the activities in MongoDB that the store does not have")
+    evict_parser = commands.add_parser("evict", help="remove old activities or keep the store under a size")
+    evict_parser.add_argument("--max-age-days", type=float, help="remove activities that started longer ago")
+    evict_parser.add_argument("--max-mb", type=float, help="remove the oldest activities beyond this size")
+    commands.add_parser("compact", help="remove orphaned files and vacuum the index")
+    args = parser.parse_args()
+
+    if args.command == "add":
+        print(f"{add_fit_files(args.paths, args.store)} activities added.")
+    elif args.command == "sync":
+        import data
+        print(f"{sync_from_mongo(data.get_garmin_collection(), args.store)} activities copied.")
+    elif args.command == "evict":
+        max_bytes = args.max_mb * 1e6 if args.max_mb is not None else None
+        print(f"{evict(args.store, args.max_age_days, max_bytes)} activities evicted.")
+    else:
+        orphans, missing = compact(args.store)
+        print(f"{orphans} orphaned files and {missing} missing activities removed.")
+
+
+if __name__ == "__main__":
+    main()
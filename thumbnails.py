@@ -0,0 +1,34 @@
+import numpy as np
+
+import downsample
+
+# Side of the square thumbnail (px) and the points kept from the route
+THUMBNAIL_SIZE = 120
+THUMBNAIL_POINTS = 150
+MARGIN = 6
+
+
+def project(lat, long, size=THUMBNAIL_SIZE, margin=MARGIN):
+    """Pixel coordinates of a route (degrees), fitted into a `size` square with north up."""
+    x, y = downsample.planar(lat, long)
+    span = max(np.ptp(x), np.ptp(y)) or 1.0
+    scale = (size - 2 * margin) / span
+    # Centered on both axes, with y growing downwards like image rows
+    px = margin + (x - x.min()) * scale + (size - 2 * margin - np.ptp(x) * scale) / 2
+    py = margin + (y.max() - y) * scale + (size - 2 * margin - np.ptp(y) * scale) / 2
+    return px, py
+
+
+def route_svg(lat, long, size=THUMBNAIL_SIZE, n_out=THUMBNAIL_POINTS):
+    """A small SVG drawing of a route (degrees), without any map tiles.
+
+    The route is simplified first, so the SVG is a couple of kilobytes of text
+    that can be stored with the activity summary and shown with st.image.
+    """
+    indices = downsample.douglas_peucker(lat, long, n_out)
+    px, py = project(np.asarray(lat)[indices], np.asarray(long)[indices], size)
+    points = " ".join(f"{x:.1f},{y:.1f}" for x, y in zip(px, py))
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" viewBox="0 0 {size} {size}">'
+            f'<rect width="{size}" height="{size}" rx="8" fill="#f0f2f6"/>'
+            f'<polyline points="{points}" fill="none" stroke="blue" stroke-width="2" '
+            f'stroke-linejoin="round" stroke-linecap="round" stroke-opacity="0.8"/></svg>')
@@ -1,4 +1 @@
-unzip *.zip
-rm *.zip
-python3 fit_json.py *.fit
-rm *.fit
+python3 fit_json.py *.zip && rm *.zip